@@ -0,0 +1,147 @@
+import json
+import threading
+import time
+from http.client import HTTPConnection, HTTPResponse, RemoteDisconnected
+from typing import Any, Dict, Optional, Tuple, Union
+from urllib.parse import urlparse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+_json_encoder = json.JSONEncoder(ensure_ascii=False)
+
+
+def json_dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return _json_encoder.encode(obj).encode("utf-8")
+
+
+def json_dumps_line(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
+    return (_json_encoder.encode(obj) + "\n").encode("utf-8")
+
+
+json_loads = orjson.loads if orjson is not None else json.loads
+
+
+_local = threading.local()
+
+
+def _pool() -> Dict[Tuple[str, int], HTTPConnection]:
+    pool = getattr(_local, "pool", None)
+    if pool is None:
+        pool = {}
+        _local.pool = pool
+    return pool
+
+
+class HttpClient:
+    def __init__(self, base_url: str, timeout_s: float = 300.0) -> None:
+        u = urlparse(base_url)
+        if u.scheme != "http":
+            raise RuntimeError(f"only http is supported, got {u.scheme}")
+        self.host = u.hostname or "127.0.0.1"
+        self.port = int(u.port or 80)
+        self.prefix = u.path.rstrip("/")
+        self.timeout_s = timeout_s
+
+    def _conn(self, timeout_s: Optional[float]) -> HTTPConnection:
+        pool = _pool()
+        key = (self.host, self.port)
+        conn = pool.get(key)
+        if conn is None:
+            conn = HTTPConnection(self.host, self.port, timeout=self.timeout_s)
+            pool[key] = conn
+        t = self.timeout_s if timeout_s is None else timeout_s
+        conn.timeout = t
+        if conn.sock is not None:
+            conn.sock.settimeout(t)
+        return conn
+
+    def close(self) -> None:
+        conn = _pool().pop((self.host, self.port), None)
+        if conn is not None:
+            conn.close()
+
+    def send(
+        self,
+        method: str,
+        path: str,
+        payload: Union[Dict[str, Any], bytes, None] = None,
+        timeout_s: Optional[float] = None,
+        extra_headers: Optional[Dict[str, str]] = None,
+        accept: Optional[str] = None,
+    ) -> HTTPResponse:
+        data = None
+        headers = {"Content-Type": "application/json", "Connection": "keep-alive"}
+        if accept:
+            headers["Accept"] = accept
+        if extra_headers:
+            headers.update(extra_headers)
+        if isinstance(payload, bytes):
+            data = payload
+        elif payload is not None:
+            data = json_dumps(payload)
+        conn = self._conn(timeout_s)
+        url = self.prefix + path
+        reused = conn.sock is not None
+        try:
+            conn.request(method, url, body=data, headers=headers)
+            return conn.getresponse()
+        except (RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            conn.close()
+            if not reused:
+                raise
+        conn.request(method, url, body=data, headers=headers)
+        return conn.getresponse()
+
+    def finish(self, resp: HTTPResponse, reuse: bool = True) -> None:
+        if reuse:
+            resp.read()
+        if not reuse or resp.will_close:
+            self.close()
+
+    def request_bytes(
+        self,
+        method: str,
+        path: str,
+        payload: Union[Dict[str, Any], bytes, None] = None,
+        timeout_s: Optional[float] = None,
+        extra_headers: Optional[Dict[str, str]] = None,
+    ) -> Tuple[int, Dict[str, str], bytes]:
+        try:
+            resp = self.send(method, path, payload, timeout_s, extra_headers)
+            body = resp.read()
+            if resp.will_close:
+                self.close()
+            return int(resp.status), dict(resp.getheaders()), body
+        except Exception as e:
+            self.close()
+            return 0, {}, str(e).encode("utf-8", errors="replace")
+
+    def request_json(
+        self,
+        method: str,
+        path: str,
+        payload: Union[Dict[str, Any], bytes, None] = None,
+        timeout_s: Optional[float] = None,
+        extra_headers: Optional[Dict[str, str]] = None,
+    ) -> Tuple[int, Dict[str, str], str]:
+        st, headers, body = self.request_bytes(method, path, payload, timeout_s, extra_headers)
+        return st, headers, body.decode("utf-8", errors="replace")
+
+    def wait_ready(self, timeout_s: float = 30.0, path: str = "/v1/models", interval_s: float = 0.2) -> None:
+        deadline = time.time() + timeout_s
+        last_err: Optional[str] = None
+        while time.time() < deadline:
+            st, _, body = self.request_json("GET", path, None, timeout_s=5.0)
+            if 200 <= st < 300:
+                return
+            last_err = f"http {st}: {body[:200]}"
+            time.sleep(interval_s)
+        raise RuntimeError(f"runtime not ready: {last_err or 'unknown error'}")
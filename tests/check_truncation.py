@@ -1,16 +1,22 @@
 import argparse
-import json
+import io
 import os
 import subprocess
 import sys
 import time
-import urllib.error
 import urllib.parse
-import urllib.request
-from typing import Any, Dict, Optional, Tuple
-from http.client import HTTPConnection
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
 from urllib.parse import urlparse
 
+from _http_util import HttpClient, json_dumps as _dumps, json_dumps_line, json_loads as _loads, orjson
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
 
 def _no_proxy_env() -> None:
     os.environ["NO_PROXY"] = "127.0.0.1,localhost"
@@ -20,126 +26,159 @@ def _no_proxy_env() -> None:
             os.environ.pop(k, None)
 
 
-def _wait_ready(base_url: str, timeout_s: float) -> None:
-    deadline = time.time() + timeout_s
-    last_err: Optional[str] = None
-    while time.time() < deadline:
-        try:
-            st, _, body = http_json("GET", f"{base_url}/v1/models", None, timeout_s=5.0)
-            if 200 <= st < 300:
-                return
-            last_err = f"http {st}: {body[:200]}"
-        except Exception as e:
-            last_err = str(e)
-        time.sleep(0.2)
-    raise RuntimeError(f"runtime not ready: {last_err or 'unknown error'}")
-
-
-def http_json(
-    method: str,
-    url: str,
-    payload: Optional[Dict[str, Any]],
-    timeout_s: float,
-    extra_headers: Optional[Dict[str, str]] = None,
-) -> Tuple[int, Dict[str, str], str]:
-    data = None
-    headers = {"Content-Type": "application/json"}
-    if extra_headers:
-        headers.update(extra_headers)
-    if payload is not None:
-        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
-    req = urllib.request.Request(url, data=data, method=method, headers=headers)
+def _fast_extract_delta(b: bytes) -> Optional[Tuple[str, Optional[str]]]:
+    i = b.find(b'"delta":{"content":"')
+    if i < 0 or b.find(b'"delta":', i + 8) >= 0:
+        return None
+    start = i + 20
+    end = start
+    while True:
+        end = b.find(b'"', end)
+        if end < 0:
+            return None
+        k = end
+        while b[k - 1] == 0x5C:
+            k -= 1
+        if (end - k) % 2 == 0:
+            break
+        end += 1
+    raw = b[start:end]
+    txt = _loads(b[start - 1 : end + 1]) if b"\\" in raw else raw.decode("utf-8", errors="replace")
+    fr: Optional[str] = None
+    f = b.find(b'"finish_reason":')
+    if f >= 0:
+        f += 16
+        if b.startswith(b"null", f):
+            fr = None
+        elif b.startswith(b'"', f):
+            fe = b.find(b'"', f + 1)
+            if fe < 0:
+                return None
+            fr = b[f + 1 : fe].decode("utf-8", errors="replace")
+        else:
+            return None
+    return txt, fr
+
+
+def _choice_fields(j: Any, key: str) -> Tuple[Optional[str], Optional[str]]:
+    try:
+        c0 = j["choices"][0]
+        fr = c0.get("finish_reason")
+    except (KeyError, IndexError, TypeError, AttributeError):
+        return None, None
     try:
-        with urllib.request.urlopen(req, timeout=timeout_s) as resp:
-            body = resp.read().decode("utf-8", errors="replace")
-            headers_out = {k: v for k, v in resp.headers.items()}
-            return int(getattr(resp, "status", 0) or 0), headers_out, body
-    except urllib.error.HTTPError as e:
-        body = e.read().decode("utf-8", errors="replace") if hasattr(e, "read") else ""
-        headers_out = {k: v for k, v in getattr(e, "headers", {}).items()} if getattr(e, "headers", None) else {}
-        return int(getattr(e, "code", 0) or 0), headers_out, body
+        txt = c0[key]["content"]
+    except (KeyError, TypeError):
+        txt = None
+    return (txt if isinstance(txt, str) else None), (fr if isinstance(fr, str) else None)
 
 
 def _sse_chat_once(
     base_url: str,
-    payload: Dict[str, Any],
+    payload: Union[Dict[str, Any], bytes],
     timeout_s: float,
     max_deltas: int = 0,
     max_seconds: float = 0.0,
     extra_headers: Optional[Dict[str, str]] = None,
 ) -> Tuple[str, Optional[str], Dict[str, str], int, bool]:
-    u = urlparse(f"{base_url}/v1/chat/completions")
-    if u.scheme != "http":
-        raise RuntimeError(f"only http is supported, got {u.scheme}")
-    conn = HTTPConnection(u.hostname, u.port, timeout=timeout_s)
-    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
-    headers = {"Content-Type": "application/json", "Accept": "text/event-stream"}
-    if extra_headers:
-        headers.update(extra_headers)
-    conn.request("POST", u.path, body=body, headers=headers)
-    resp = conn.getresponse()
+    client = HttpClient(base_url, timeout_s=timeout_s)
+    resp = client.send(
+        "POST",
+        "/v1/chat/completions",
+        payload,
+        timeout_s=timeout_s,
+        extra_headers=extra_headers,
+        accept="text/event-stream",
+    )
     status = resp.status
     headers_out = {k: v for k, v in resp.getheaders()}
     if status < 200 or status >= 300:
         raw = resp.read().decode("utf-8", errors="replace")
+        if resp.will_close:
+            client.close()
         raise RuntimeError(f"chat stream failed: http {status}: {raw[:500]}")
 
-    acc = ""
+    parts: List[str] = []
     finish_reason: Optional[str] = None
     deltas = 0
     done = False
+    stop = False
+    read_chunk = getattr(resp, "read1", None) or resp.read
+    buf = bytearray()
+    pos = 0
     t0 = time.time()
-    while True:
+    while not stop:
         if max_seconds and max_seconds > 0 and (time.time() - t0) >= float(max_seconds):
             break
-        line = resp.readline()
-        if not line:
-            break
-        s = line.decode("utf-8", errors="replace").strip()
-        if not s:
-            continue
-        if not s.startswith("data:"):
-            continue
-        data = s[len("data:") :].strip()
-        if data == "[DONE]":
-            done = True
-            break
-        j = json.loads(data)
-        if isinstance(j, dict):
-            choices = j.get("choices")
-            if isinstance(choices, list) and choices:
-                c0 = choices[0]
-                if isinstance(c0, dict):
-                    fr = c0.get("finish_reason")
-                    if isinstance(fr, str):
-                        finish_reason = fr
-                    delta = c0.get("delta")
-                    if isinstance(delta, dict):
-                        txt = delta.get("content")
-                        if isinstance(txt, str):
-                            acc += txt
-                            deltas += 1
-                            if max_deltas > 0 and deltas >= max_deltas:
-                                break
-        if max_deltas > 0 and deltas >= max_deltas:
+        chunk = read_chunk(65536)
+        if not chunk:
             break
-    conn.close()
-    return acc, finish_reason, headers_out, deltas, done
+        if pos > 32768:
+            del buf[:pos]
+            pos = 0
+        buf += chunk
+        while True:
+            nl = buf.find(b"\n", pos)
+            if nl < 0:
+                break
+            start = pos
+            pos = nl + 1
+            if not buf.startswith(b"data:", start, nl):
+                continue
+            start += 5
+            if start < nl and buf[start] == 0x20:
+                start += 1
+            end = nl - 1 if nl > start and buf[nl - 1] == 0x0D else nl
+            data = bytes(buf[start:end])
+            if data == b"[DONE]":
+                done = True
+                stop = True
+                break
+            fast = _fast_extract_delta(data)
+            if fast is not None:
+                txt, fr = fast
+                if fr is not None:
+                    finish_reason = fr
+                parts.append(txt)
+                deltas += 1
+            else:
+                txt, fr = _choice_fields(_loads(data), "delta")
+                if fr is not None:
+                    finish_reason = fr
+                if txt is not None:
+                    parts.append(txt)
+                    deltas += 1
+            if max_deltas > 0 and deltas >= max_deltas:
+                stop = True
+                break
+    client.finish(resp, reuse=done)
+    return "".join(parts), finish_reason, headers_out, deltas, done
 
 
+@lru_cache(maxsize=16)
 def _make_system_prompt_bytes(n: int) -> str:
     base = (
         "You are a coding agent running in the opencode, a terminal-based coding assistant.\n"
         "Follow the user's instructions.\n"
     )
-    if n <= len(base):
-        return base[:n]
-    fill = "AGENTS.md spec\n" * 2048
-    s = base + fill
-    while len(s.encode("utf-8")) < n:
-        s += fill
-    out = s.encode("utf-8")[:n].decode("utf-8", errors="ignore")
-    return out
+    base_b = base.encode("utf-8")
+    if n <= len(base_b):
+        return base_b[:n].decode("utf-8", errors="ignore")
+    fill_b = b"AGENTS.md spec\n" * 2048
+    reps = (n - len(base_b)) // len(fill_b) + 1
+    return (base_b + fill_b * reps)[:n].decode("utf-8", errors="ignore")
+
+
+@lru_cache(maxsize=16)
+def _encode_system_msg(system_bytes: int) -> bytes:
+    return _dumps({"role": "system", "content": _make_system_prompt_bytes(system_bytes)})
+
+
+def _encode_chat_body(fields: Dict[str, Any], system_bytes: int, prompt: str) -> bytes:
+    head = _dumps(fields)
+    sep = b"," if len(head) > 2 else b""
+    user_msg = _dumps({"role": "user", "content": prompt})
+    return head[:-1] + sep + b'"messages":[' + _encode_system_msg(system_bytes) + b"," + user_msg + b"]}"
 
 
 def run_one(
@@ -156,16 +195,8 @@ def run_one(
     tools: str,
     max_steps: int,
     max_tool_calls: int,
-) -> None:
-    system_prompt = _make_system_prompt_bytes(system_bytes)
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {
-            "role": "user",
-            "content": prompt,
-        },
-    ]
-    payload: Dict[str, Any] = {"model": model, "messages": messages, "max_tokens": max_tokens}
+) -> Dict[str, Any]:
+    payload: Dict[str, Any] = {"model": model, "max_tokens": max_tokens}
     tools_s = (tools or "").strip()
     if tools_s:
         payload["tools"] = [x.strip() for x in tools_s.split(",") if x.strip()]
@@ -177,7 +208,7 @@ def run_one(
         payload["stream"] = True
         text, fr, _, deltas, done = _sse_chat_once(
             base_url,
-            payload,
+            _encode_chat_body(payload, system_bytes, prompt),
             timeout_s=timeout_s,
             max_deltas=stream_max_deltas,
             max_seconds=stream_max_seconds,
@@ -187,54 +218,85 @@ def run_one(
             partial = True
         if require_done and not done:
             raise RuntimeError("stream did not finish with [DONE]")
-        print(
-            json.dumps(
-                {
-                    "stream": True,
-                    "system_bytes": system_bytes,
-                    "max_tokens": max_tokens,
-                    "completion_chars": len(text),
-                    "finish_reason": fr,
-                    "partial": partial,
-                    "deltas": deltas,
-                    "sample": text[:120],
-                },
-                ensure_ascii=True,
-            )
-        )
-        return
+        return {
+            "stream": True,
+            "system_bytes": system_bytes,
+            "max_tokens": max_tokens,
+            "completion_chars": len(text),
+            "finish_reason": fr,
+            "partial": partial,
+            "deltas": deltas,
+            "sample": text[:120],
+        }
 
     payload["stream"] = False
-    st, _, body = http_json("POST", f"{base_url}/v1/chat/completions", payload, timeout_s=timeout_s)
+    body_b = _encode_chat_body(payload, system_bytes, prompt)
+    st, _, body = HttpClient(base_url).request_json("POST", "/v1/chat/completions", body_b, timeout_s=timeout_s)
     if st < 200 or st >= 300:
         raise RuntimeError(f"chat failed: http {st}: {body[:500]}")
-    j = json.loads(body)
-    fr = None
-    txt = ""
-    if isinstance(j, dict):
-        choices = j.get("choices")
-        if isinstance(choices, list) and choices and isinstance(choices[0], dict):
-            fr0 = choices[0].get("finish_reason")
-            if isinstance(fr0, str):
-                fr = fr0
-            msg = choices[0].get("message")
-            if isinstance(msg, dict):
-                c = msg.get("content")
-                if isinstance(c, str):
-                    txt = c
-    print(
-        json.dumps(
-            {
-                "stream": False,
-                "system_bytes": system_bytes,
-                "max_tokens": max_tokens,
-                "completion_chars": len(txt),
-                "finish_reason": fr,
-                "sample": txt[:120],
-            },
-            ensure_ascii=True,
-        )
-    )
+    txt, fr = _choice_fields(_loads(body), "message")
+    if txt is None:
+        txt = ""
+    return {
+        "stream": False,
+        "system_bytes": system_bytes,
+        "max_tokens": max_tokens,
+        "completion_chars": len(txt),
+        "finish_reason": fr,
+        "sample": txt[:120],
+    }
+
+
+def _emit_row(row: Dict[str, Any]) -> None:
+    out = sys.stdout.buffer
+    out.write(json_dumps_line(row))
+    out.flush()
+
+
+def _iter_model_items(body: bytes) -> Iterator[Any]:
+    if orjson is None and ijson is not None:
+        seen = False
+        try:
+            for it in ijson.items(io.BytesIO(body), "data.item"):
+                seen = True
+                yield it
+        except ijson.JSONError:
+            raise RuntimeError("invalid /v1/models response")
+        if not seen:
+            raise RuntimeError("invalid /v1/models response")
+        return
+    try:
+        jm = _loads(body)
+    except ValueError:
+        raise RuntimeError("invalid /v1/models response")
+    if not isinstance(jm, dict) or "data" not in jm or not isinstance(jm["data"], list) or not jm["data"]:
+        raise RuntimeError("invalid /v1/models response")
+    yield from jm["data"]
+
+
+def _pick_model(body: bytes, prefer_prefix: str) -> str:
+    prefixed = None
+    unprefixed = None
+    first = None
+    for it in _iter_model_items(body):
+        if not isinstance(it, dict):
+            continue
+        mid = it.get("id")
+        if not isinstance(mid, str) or not mid:
+            continue
+        if first is None:
+            first = mid
+        if prefer_prefix and prefixed is None and mid.startswith(prefer_prefix):
+            prefixed = mid
+            break
+        if unprefixed is None and ":" not in mid:
+            unprefixed = mid
+            if not prefer_prefix:
+                break
+    picked = prefixed or unprefixed or first
+    if not picked:
+        raise RuntimeError("no model id found in /v1/models")
+    return picked
 
 
 def main() -> int:
@@ -251,6 +313,7 @@ def main() -> int:
     ap.add_argument("--stream-max-deltas", type=int, default=0)
     ap.add_argument("--stream-max-seconds", type=float, default=0.0)
     ap.add_argument("--require-done", action="store_true")
+    ap.add_argument("--concurrency", type=int, default=1)
     ap.add_argument("--timeout-s", type=float, default=300.0)
     ap.add_argument("--tools", default="")
     ap.add_argument("--max-steps", type=int, default=0)
@@ -278,72 +341,45 @@ def main() -> int:
                 renv["LLAMA_CPP_MODEL"] = args.llama_model_root
             rt = subprocess.Popen([args.runtime_exe], env=renv)
 
-        _wait_ready(args.base_url, timeout_s=60.0)
+        client = HttpClient(args.base_url, timeout_s=args.timeout_s)
+        client.wait_ready(timeout_s=60.0)
 
         model = args.model
         if not model:
-            st, _, body = http_json("GET", f"{args.base_url}/v1/models", None, timeout_s=30.0)
+            st, _, body = client.request_bytes("GET", "/v1/models", None, timeout_s=30.0)
             if st < 200 or st >= 300:
-                raise RuntimeError(f"/v1/models failed: http {st}: {body[:200]}")
-            jm = json.loads(body)
-            if not isinstance(jm, dict) or "data" not in jm or not isinstance(jm["data"], list) or not jm["data"]:
-                raise RuntimeError("invalid /v1/models response")
-            prefixed = None
-            unprefixed = None
-            first = None
-            prefer_prefix = f"{args.provider}:" if args.provider else ""
-            for it in jm["data"]:
-                if not isinstance(it, dict):
-                    continue
-                mid = it.get("id")
-                if not isinstance(mid, str) or not mid:
-                    continue
-                if first is None:
-                    first = mid
-                if prefer_prefix and prefixed is None and mid.startswith(prefer_prefix):
-                    prefixed = mid
-                if unprefixed is None and ":" not in mid:
-                    unprefixed = mid
-            picked = prefixed or unprefixed or first
-            if not picked:
-                raise RuntimeError("no model id found in /v1/models")
-            model = picked
+                raise RuntimeError(f"/v1/models failed: http {st}: {body[:200].decode('utf-8', errors='replace')}")
+            model = _pick_model(body, f"{args.provider}:" if args.provider else "")
+
+        def run_case(system_bytes: int, max_tokens: int) -> Dict[str, Any]:
+            return run_one(
+                args.base_url,
+                model,
+                system_bytes,
+                max_tokens,
+                args.stream,
+                args.prompt,
+                args.timeout_s,
+                args.stream_max_deltas,
+                args.stream_max_seconds,
+                args.require_done,
+                args.tools,
+                args.max_steps,
+                args.max_tool_calls,
+            )
 
         if args.matrix:
-            for system_bytes in [0, 2048, 8192, 20000, 70000]:
-                for max_tokens in [128, 512, 2048, 4096]:
-                    run_one(
-                        args.base_url,
-                        model,
-                        system_bytes,
-                        max_tokens,
-                        args.stream,
-                        args.prompt,
-                        args.timeout_s,
-                        args.stream_max_deltas,
-                        args.stream_max_seconds,
-                        args.require_done,
-                        args.tools,
-                        args.max_steps,
-                        args.max_tool_calls,
-                    )
+            cases = [(sb, mt) for sb in [0, 2048, 8192, 20000, 70000] for mt in [128, 512, 2048, 4096]]
+            if args.concurrency > 1 and not args.stream:
+                with ThreadPoolExecutor(max_workers=args.concurrency) as ex:
+                    for row in ex.map(lambda c: run_case(*c), cases):
+                        _emit_row(row)
+            else:
+                for sb, mt in cases:
+                    _emit_row(run_case(sb, mt))
             return 0
 
-        run_one(
-            args.base_url,
-            model,
-            args.system_bytes,
-            args.max_tokens,
-            args.stream,
-            args.prompt,
-            args.timeout_s,
-            args.stream_max_deltas,
-            args.stream_max_seconds,
-            args.require_done,
-            args.tools,
-            args.max_steps,
-            args.max_tool_calls,
-        )
+        _emit_row(run_case(args.system_bytes, args.max_tokens))
         return 0
     finally:
         if rt is not None:
@@ -1,116 +1,61 @@
 import argparse
 import ctypes
-import json
 import os
+import selectors
+import socket
 import subprocess
 import sys
 import time
-import urllib.error
-import urllib.request
 from dataclasses import dataclass
 from typing import Any, Dict, List, Optional, Tuple
 
+from _http_util import HttpClient, json_loads as _loads
 
-def http_json(
-    method: str,
-    url: str,
-    payload: Optional[Dict[str, Any]] = None,
-    timeout_s: float = 300.0,
-    extra_headers: Optional[Dict[str, str]] = None,
-) -> Tuple[int, Dict[str, str], str]:
-    data = None
-    headers = {"Content-Type": "application/json"}
-    if extra_headers:
-        headers.update(extra_headers)
-    if payload is not None:
-        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
-    req = urllib.request.Request(url, data=data, method=method)
-    for k, v in headers.items():
-        req.add_header(k, v)
-    try:
-        with urllib.request.urlopen(req, timeout=timeout_s) as resp:
-            body = resp.read().decode("utf-8", errors="replace")
-            return int(resp.status), dict(resp.headers.items()), body
-    except urllib.error.HTTPError as e:
-        body = ""
-        try:
-            body = e.read().decode("utf-8", errors="replace")
-        except Exception:
-            body = ""
-        return int(e.code), dict(e.headers.items()) if e.headers else {}, body
-    except Exception as e:
-        return 0, {}, str(e)
 
 def http_stream(
+    client: HttpClient,
     method: str,
-    url: str,
+    path: str,
     payload: Optional[Dict[str, Any]] = None,
-    timeout_s: float = 300.0,
     extra_headers: Optional[Dict[str, str]] = None,
 ) -> Tuple[int, Dict[str, str], str]:
-    data = None
-    headers = {"Content-Type": "application/json"}
-    if extra_headers:
-        headers.update(extra_headers)
-    if payload is not None:
-        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
-    req = urllib.request.Request(url, data=data, method=method)
-    for k, v in headers.items():
-        req.add_header(k, v)
     try:
-        with urllib.request.urlopen(req, timeout=timeout_s) as resp:
-            out = ""
-            while True:
-                raw = resp.readline()
-                if not raw:
-                    break
-                line = raw.decode("utf-8", errors="replace").rstrip("\r\n")
-                if not line:
-                    continue
-                if not line.startswith("data:"):
-                    continue
-                payload = line[len("data:") :].lstrip()
-                if payload == "[DONE]":
-                    break
-                try:
-                    j = json.loads(payload)
-                except Exception:
-                    continue
-                choices = j.get("choices") or []
-                if not choices or not isinstance(choices, list):
-                    continue
-                delta = choices[0].get("delta") if isinstance(choices[0], dict) else None
-                if not isinstance(delta, dict):
-                    continue
-                piece = delta.get("content")
-                if isinstance(piece, str) and piece:
-                    out += piece
-            return int(resp.status), dict(resp.headers.items()), out
-    except urllib.error.HTTPError as e:
-        body = ""
-        try:
-            body = e.read().decode("utf-8", errors="replace")
-        except Exception:
-            body = ""
-        return int(e.code), dict(e.headers.items()) if e.headers else {}, body
+        resp = client.send(method, path, payload, extra_headers=extra_headers, accept="text/event-stream")
+        headers_out = dict(resp.getheaders())
+        if resp.status < 200 or resp.status >= 300:
+            body = resp.read().decode("utf-8", errors="replace")
+            if resp.will_close:
+                client.close()
+            return int(resp.status), headers_out, body
+        parts: List[str] = []
+        while True:
+            line = resp.readline()
+            if not line:
+                break
+            if not line.startswith(b"data:"):
+                continue
+            data = line[5:].strip()
+            if data == b"[DONE]":
+                break
+            try:
+                j = _loads(data)
+            except Exception:
+                continue
+            try:
+                piece = j["choices"][0]["delta"]["content"]
+            except (KeyError, IndexError, TypeError):
+                continue
+            if isinstance(piece, str) and piece:
+                parts.append(piece)
+        client.finish(resp)
+        return int(resp.status), headers_out, "".join(parts)
     except Exception as e:
+        client.close()
         return 0, {}, str(e)
 
 
-def wait_ready(base_url: str, timeout_s: float = 30.0) -> None:
-    deadline = time.time() + timeout_s
-    last_err = None
-    while time.time() < deadline:
-        st, _, body = http_json("GET", f"{base_url}/v1/models", None, timeout_s=5.0)
-        if 200 <= st < 300:
-            return
-        last_err = (st, body)
-        time.sleep(0.3)
-    raise RuntimeError(f"runtime not ready: {last_err}")
-
-
 def parse_models(body: str) -> List[str]:
-    j = json.loads(body)
+    j = _loads(body)
     data = j.get("data") or []
     out: List[str] = []
     for it in data:
@@ -142,47 +87,110 @@ class ProcMem:
     private_mb: float
 
 
-def get_process_memory_mb_windows(pid: int) -> Optional[ProcMem]:
-    if os.name != "nt":
-        return None
+class PROCESS_MEMORY_COUNTERS_EX(ctypes.Structure):
+    _fields_ = [
+        ("cb", ctypes.c_ulong),
+        ("PageFaultCount", ctypes.c_ulong),
+        ("PeakWorkingSetSize", ctypes.c_size_t),
+        ("WorkingSetSize", ctypes.c_size_t),
+        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+        ("QuotaPagedPoolUsage", ctypes.c_size_t),
+        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+        ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+        ("PagefileUsage", ctypes.c_size_t),
+        ("PeakPagefileUsage", ctypes.c_size_t),
+        ("PrivateUsage", ctypes.c_size_t),
+    ]
+
+
+class WinProcMem:
+    def __init__(self, pid: int):
+        self.pid = pid
+        self._handle = None
+        self._counters = PROCESS_MEMORY_COUNTERS_EX()
+        self._counters.cb = ctypes.sizeof(PROCESS_MEMORY_COUNTERS_EX)
+        if os.name != "nt":
+            return
 
-    PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
-    PROCESS_VM_READ = 0x0010
+        PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+        PROCESS_VM_READ = 0x0010
+
+        handle = ctypes.windll.kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION | PROCESS_VM_READ, False, pid)
+        if handle:
+            self._handle = handle
+
+    def sample(self) -> Optional[ProcMem]:
+        if not self._handle:
+            return None
+        counters = self._counters
+        ok = ctypes.windll.psapi.GetProcessMemoryInfo(self._handle, ctypes.byref(counters), counters.cb)
+        if not ok:
+            return None
+        return ProcMem(
+            working_set_mb=float(counters.WorkingSetSize) / (1024.0 * 1024.0),
+            private_mb=float(counters.PrivateUsage) / (1024.0 * 1024.0),
+        )
 
-    handle = ctypes.windll.kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION | PROCESS_VM_READ, False, pid)
-    if not handle:
-        return None
+    def close(self) -> None:
+        if self._handle:
+            ctypes.windll.kernel32.CloseHandle(self._handle)
+            self._handle = None
+
+    def __enter__(self) -> "WinProcMem":
+        return self
 
-    class PROCESS_MEMORY_COUNTERS_EX(ctypes.Structure):
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    def __del__(self) -> None:
+        self.close()
+
+
+def _find_pid_by_listen_port_iphlpapi(port: int) -> Optional[int]:
+    AF_INET = 2
+    TCP_TABLE_OWNER_PID_LISTENER = 3
+    ERROR_INSUFFICIENT_BUFFER = 122
+
+    class MIB_TCPROW_OWNER_PID(ctypes.Structure):
         _fields_ = [
-            ("cb", ctypes.c_ulong),
-            ("PageFaultCount", ctypes.c_ulong),
-            ("PeakWorkingSetSize", ctypes.c_size_t),
-            ("WorkingSetSize", ctypes.c_size_t),
-            ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
-            ("QuotaPagedPoolUsage", ctypes.c_size_t),
-            ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
-            ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
-            ("PagefileUsage", ctypes.c_size_t),
-            ("PeakPagefileUsage", ctypes.c_size_t),
-            ("PrivateUsage", ctypes.c_size_t),
+            ("dwState", ctypes.c_ulong),
+            ("dwLocalAddr", ctypes.c_ulong),
+            ("dwLocalPort", ctypes.c_ulong),
+            ("dwRemoteAddr", ctypes.c_ulong),
+            ("dwRemotePort", ctypes.c_ulong),
+            ("dwOwningPid", ctypes.c_ulong),
         ]
 
-    counters = PROCESS_MEMORY_COUNTERS_EX()
-    counters.cb = ctypes.sizeof(PROCESS_MEMORY_COUNTERS_EX)
-    ok = ctypes.windll.psapi.GetProcessMemoryInfo(handle, ctypes.byref(counters), counters.cb)
-    ctypes.windll.kernel32.CloseHandle(handle)
-    if not ok:
+    get_table = ctypes.windll.iphlpapi.GetExtendedTcpTable
+    size = ctypes.c_ulong(0)
+    get_table(None, ctypes.byref(size), False, AF_INET, TCP_TABLE_OWNER_PID_LISTENER, 0)
+    for _ in range(3):
+        buf = ctypes.create_string_buffer(size.value)
+        ret = get_table(buf, ctypes.byref(size), False, AF_INET, TCP_TABLE_OWNER_PID_LISTENER, 0)
+        if ret == 0:
+            break
+        if ret != ERROR_INSUFFICIENT_BUFFER:
+            return None
+    else:
         return None
-    return ProcMem(
-        working_set_mb=float(counters.WorkingSetSize) / (1024.0 * 1024.0),
-        private_mb=float(counters.PrivateUsage) / (1024.0 * 1024.0),
-    )
+
+    n = ctypes.c_ulong.from_buffer(buf).value
+    rows = (MIB_TCPROW_OWNER_PID * n).from_buffer(buf, ctypes.sizeof(ctypes.c_ulong))
+    for row in rows:
+        if socket.ntohs(row.dwLocalPort & 0xFFFF) == port:
+            return int(row.dwOwningPid)
+    return None
 
 
 def find_pid_by_listen_port_windows(port: int) -> Optional[int]:
     if os.name != "nt":
         return None
+    try:
+        pid = _find_pid_by_listen_port_iphlpapi(port)
+        if pid is not None:
+            return pid
+    except Exception:
+        pass
     try:
         p = subprocess.run(
             ["netstat", "-ano", "-p", "TCP"],
@@ -227,8 +235,6 @@ def start_process(argv: List[str], env: Dict[str, str]) -> subprocess.Popen:
         stdin=subprocess.DEVNULL,
         stdout=subprocess.PIPE,
         stderr=subprocess.STDOUT,
-        text=True,
-        bufsize=1,
     )
 
 
@@ -245,23 +251,53 @@ def stop_process(p: Optional[subprocess.Popen]) -> None:
             pass
 
 
-def drain_output_nonblocking(p: subprocess.Popen, max_lines: int = 200) -> None:
+def _pipe_available_windows(fd: int) -> int:
+    import msvcrt
+
+    avail = ctypes.c_ulong(0)
+    handle = ctypes.c_void_p(msvcrt.get_osfhandle(fd))
+    if not ctypes.windll.kernel32.PeekNamedPipe(handle, None, 0, None, ctypes.byref(avail), None):
+        return 0
+    return int(avail.value)
+
+
+def drain_output_nonblocking(p: subprocess.Popen, max_bytes: int = 256 * 1024) -> None:
     if not p.stdout:
         return
-    lines = 0
-    while lines < max_lines:
-        line = p.stdout.readline()
-        if not line:
-            break
-        sys.stdout.write(line)
-        lines += 1
+    fd = p.stdout.fileno()
+    sys.stdout.flush()
+    out = sys.stdout.buffer
+    total = 0
+    if os.name == "nt":
+        while total < max_bytes:
+            n = _pipe_available_windows(fd)
+            if n <= 0:
+                break
+            chunk = os.read(fd, min(n, 65536))
+            if not chunk:
+                break
+            out.write(chunk)
+            total += len(chunk)
+    else:
+        os.set_blocking(fd, False)
+        with selectors.DefaultSelector() as sel:
+            sel.register(fd, selectors.EVENT_READ)
+            while total < max_bytes and sel.select(timeout=0):
+                try:
+                    chunk = os.read(fd, 65536)
+                except BlockingIOError:
+                    break
+                if not chunk:
+                    break
+                out.write(chunk)
+                total += len(chunk)
+    out.flush()
 
 
 def chat_once(
-    base_url: str,
+    client: HttpClient,
     model: str,
     messages: List[Dict[str, Any]],
-    timeout_s: float = 300.0,
     extra_headers: Optional[Dict[str, str]] = None,
     extra_payload: Optional[Dict[str, Any]] = None,
     stream: bool = False,
@@ -275,18 +311,17 @@ def chat_once(
         payload.update(extra_payload)
     if stream:
         st, resp_headers, body = http_stream(
+            client,
             "POST",
-            f"{base_url}/v1/chat/completions",
+            "/v1/chat/completions",
             payload,
-            timeout_s=timeout_s,
             extra_headers=extra_headers,
         )
     else:
-        st, resp_headers, body = http_json(
+        st, resp_headers, body = client.request_json(
             "POST",
-            f"{base_url}/v1/chat/completions",
+            "/v1/chat/completions",
             payload,
-            timeout_s=timeout_s,
             extra_headers=extra_headers,
         )
     if st < 200 or st >= 300:
@@ -296,12 +331,11 @@ def chat_once(
             raise RuntimeError("invalid stream output")
         return body, resp_headers
     else:
-        j = json.loads(body)
-        choices = j.get("choices") or []
-        if not choices or not isinstance(choices, list):
-            raise RuntimeError(f"invalid response: {body}")
-        msg = choices[0].get("message") if isinstance(choices[0], dict) else None
-        content = msg.get("content") if isinstance(msg, dict) else None
+        j = _loads(body)
+        try:
+            content = j["choices"][0]["message"]["content"]
+        except (KeyError, IndexError, TypeError):
+            content = None
         if not isinstance(content, str):
             raise RuntimeError(f"invalid response: {body}")
         return content, resp_headers
@@ -345,8 +379,11 @@ def main() -> int:
             os.environ.pop(k, None)
 
     rt: Optional[subprocess.Popen] = None
+    client: Optional[HttpClient] = None
     mem_pid: Optional[int] = None
+    mem: Optional[WinProcMem] = None
     try:
+        client = HttpClient(base_url, timeout_s=300.0)
         if args.runtime_exe:
             renv = env.copy()
             renv["RUNTIME_LISTEN_HOST"] = args.host
@@ -369,16 +406,16 @@ def main() -> int:
                     renv["LLAMA_CPP_UNLOAD_AFTER_CHAT"] = str(args.llama_unload_after_chat)
 
             rt = start_process([args.runtime_exe], env=renv)
-            wait_ready(base_url, timeout_s=60.0)
+            client.wait_ready(timeout_s=60.0, interval_s=0.3)
             mem_pid = rt.pid
         else:
-            wait_ready(base_url, timeout_s=30.0)
+            client.wait_ready(timeout_s=30.0, interval_s=0.3)
             if args.pid and args.pid > 0:
                 mem_pid = int(args.pid)
             else:
                 mem_pid = find_pid_by_listen_port_windows(args.port)
 
-        st, _, body = http_json("GET", f"{base_url}/v1/models", None, timeout_s=30.0)
+        st, _, body = client.request_json("GET", "/v1/models", None, timeout_s=30.0)
         if st < 200 or st >= 300:
             raise RuntimeError(f"/v1/models failed: http {st}: {body}")
         models = parse_models(body)
@@ -388,6 +425,7 @@ def main() -> int:
         print(f"model={model}")
         if mem_pid is not None:
             print(f"runtime_pid={mem_pid}")
+            mem = WinProcMem(mem_pid)
 
         def msg(role: str, content: str) -> Dict[str, Any]:
             if args.content_format == "array":
@@ -405,33 +443,38 @@ def main() -> int:
                 return out
             return ""
 
+        sys_msg = msg("system", "你是一个严谨的助手。")
+        followup_msg = msg("user", "基于上一句，再补充一个要点（不要重复）。")
+        followup_messages = [followup_msg]
+
         for r in range(args.rounds):
-            mem0 = get_process_memory_mb_windows(mem_pid) if mem_pid is not None else None
+            mem0 = mem.sample() if mem is not None else None
             t0 = time.time()
             last_assistant = ""
 
+            first_user = msg("user", f"第{r + 1}轮：用一句话概括‘内存回收’的含义。")
+
             if args.session_mode == "client":
-                messages: List[Dict[str, Any]] = [
-                    msg("system", "你是一个严谨的助手。"),
-                    msg("user", f"第{r + 1}轮：用一句话概括‘内存回收’的含义。"),
-                ]
+                messages: List[Any] = [None] * (2 + 2 * args.turns_per_round)
+                messages[0] = sys_msg
+                messages[1] = first_user
+                idx = 2
 
                 for t in range(args.turns_per_round):
-                    last_assistant, _ = chat_once(base_url, model, messages, timeout_s=300.0, stream=args.stream)
-                    messages.append(msg("assistant", last_assistant))
+                    last_assistant, _ = chat_once(client, model, messages[:idx], stream=args.stream)
+                    messages[idx] = msg("assistant", last_assistant)
+                    idx += 1
                     if t + 1 < args.turns_per_round:
-                        messages.append(msg("user", "基于上一句，再补充一个要点（不要重复）。"))
+                        messages[idx] = followup_msg
+                        idx += 1
             else:
                 session_id: Optional[str] = None
                 for t in range(args.turns_per_round):
                     if t == 0:
-                        messages = [
-                            msg("system", "你是一个严谨的助手。"),
-                            msg("user", f"第{r + 1}轮：用一句话概括‘内存回收’的含义。"),
-                        ]
+                        messages = [sys_msg, first_user]
                         extra_payload = {"use_server_history": True}
                     else:
-                        messages = [msg("user", "基于上一句，再补充一个要点（不要重复）。")]
+                        messages = followup_messages
                         extra_payload = None
 
                     extra_headers = None
@@ -439,10 +482,9 @@ def main() -> int:
                         extra_headers = {"x-session-id": session_id}
 
                     last_assistant, resp_headers = chat_once(
-                        base_url,
+                        client,
                         model,
                         messages,
-                        timeout_s=300.0,
                         extra_headers=extra_headers,
                         extra_payload=extra_payload,
                         stream=args.stream,
@@ -451,7 +493,7 @@ def main() -> int:
                         session_id = resp_headers.get("x-session-id") or resp_headers.get("X-Session-Id")
 
             dt_ms = (time.time() - t0) * 1000.0
-            mem1 = get_process_memory_mb_windows(mem_pid) if mem_pid is not None else None
+            mem1 = mem.sample() if mem is not None else None
             assistant_len = len(content_text(last_assistant))
 
             def fmt_mem(m: Optional[ProcMem]) -> str:
@@ -465,11 +507,15 @@ def main() -> int:
                 time.sleep(args.sleep_ms / 1000.0)
 
             if rt is not None and rt.poll() is not None:
-                drain_output_nonblocking(rt, max_lines=200)
+                drain_output_nonblocking(rt)
                 raise RuntimeError(f"runtime exited early with code {rt.returncode}")
 
         return 0
     finally:
+        if mem is not None:
+            mem.close()
+        if client is not None:
+            client.close()
         stop_process(rt)
 
 
@@ -1,19 +1,49 @@
 import argparse
+import gzip
 import json
 import os
 import sys
 import time
 import uuid
-import urllib.error
-import urllib.request
-from dataclasses import dataclass
-from http.client import HTTPConnection
-from typing import Any, Dict, List, Optional, Tuple
+import zlib
+from dataclasses import dataclass, field
+from functools import lru_cache
+from http.client import HTTPConnection, HTTPResponse, RemoteDisconnected
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Union
 from urllib.parse import urlparse
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _jdumps(obj: Any) -> bytes:
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            pass
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8", errors="replace")
+
+
+def _jloads(data: Any) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    if isinstance(data, (bytes, bytearray)):
+        data = data.decode("utf-8", errors="replace")
+    return json.loads(data)
+
 
 def _clean_text_for_json(s: str) -> str:
+    if orjson is not None and isinstance(s, str):
+        return s
     try:
+        if s.isascii():
+            return s
+        s.encode("utf-8")
+        return s
+    except UnicodeEncodeError:
         return s.encode("utf-8", errors="replace").decode("utf-8", errors="replace")
     except Exception:
         return ""
@@ -27,61 +57,98 @@ def _no_proxy_env() -> None:
             os.environ.pop(k, None)
 
 
-def _build_tools(preset: str) -> List[Dict[str, Any]]:
+_PRESET_LSP: Tuple[Dict[str, Any], ...] = (
+    {"type": "function", "function": {"name": "ide.diagnostics"}},
+    {"type": "function", "function": {"name": "ide.hover"}},
+    {"type": "function", "function": {"name": "ide.definition"}},
+    {"type": "function", "function": {"name": "ide.read_file"}},
+    {"type": "function", "function": {"name": "ide.search"}},
+)
+_PRESET_ALL: Tuple[Dict[str, Any], ...] = _PRESET_LSP + (
+    {"type": "function", "function": {"name": "runtime.infer_task_status"}},
+)
+
+
+@lru_cache(maxsize=32)
+def _build_tools(preset: str) -> Tuple[Dict[str, Any], ...]:
     p = (preset or "").strip().lower()
     if p in ("", "none", "off", "0", "false"):
-        return []
+        return ()
     if p in ("lsp", "ide", "default"):
-        return [
-            {"type": "function", "function": {"name": "ide.diagnostics"}},
-            {"type": "function", "function": {"name": "ide.hover"}},
-            {"type": "function", "function": {"name": "ide.definition"}},
-            {"type": "function", "function": {"name": "ide.read_file"}},
-            {"type": "function", "function": {"name": "ide.search"}},
-        ]
+        return _PRESET_LSP
     if p == "all":
-        return [
-            {"type": "function", "function": {"name": "ide.diagnostics"}},
-            {"type": "function", "function": {"name": "ide.hover"}},
-            {"type": "function", "function": {"name": "ide.definition"}},
-            {"type": "function", "function": {"name": "ide.read_file"}},
-            {"type": "function", "function": {"name": "ide.search"}},
-            {"type": "function", "function": {"name": "runtime.infer_task_status"}},
-        ]
-    tools: List[Dict[str, Any]] = []
-    for name in [x.strip() for x in p.split(",") if x.strip()]:
-        tools.append({"type": "function", "function": {"name": name}})
-    return tools
+        return _PRESET_ALL
+    return tuple({"type": "function", "function": {"name": name}} for name in [x.strip() for x in p.split(",") if x.strip()])
 
 
-def _http_json(
+def _connect(base_url: str, timeout_s: float) -> HTTPConnection:
+    u = urlparse(base_url)
+    if u.scheme != "http":
+        raise RuntimeError(f"only http is supported, got {u.scheme}")
+    return HTTPConnection(u.hostname, u.port, timeout=timeout_s)
+
+
+def _request(
+    conn: HTTPConnection,
     method: str,
     url: str,
-    payload: Optional[Dict[str, Any]],
-    timeout_s: float,
+    body: Optional[bytes],
+    headers: Dict[str, str],
+) -> HTTPResponse:
+    path = urlparse(url).path
+    try:
+        conn.request(method, path, body=body, headers=headers)
+        return conn.getresponse()
+    except (RemoteDisconnected, ConnectionError):
+        conn.close()
+    conn.request(method, path, body=body, headers=headers)
+    return conn.getresponse()
+
+
+def _http_json_bytes(
+    conn: HTTPConnection,
+    method: str,
+    url: str,
+    payload: Union[Dict[str, Any], bytes, None],
     headers: Optional[Dict[str, str]] = None,
-) -> Tuple[int, Dict[str, str], str]:
+) -> Tuple[int, Dict[str, str], bytes]:
     data = None
-    h = {"Content-Type": "application/json"}
+    h = {"Content-Type": "application/json", "Connection": "keep-alive", "Accept-Encoding": "gzip"}
     if headers:
         h.update(headers)
-    if payload is not None:
-        data = json.dumps(payload, ensure_ascii=False).encode("utf-8", errors="replace")
-    req = urllib.request.Request(url, data=data, method=method, headers=h)
+    if isinstance(payload, bytes):
+        data = payload
+    elif payload is not None:
+        data = _jdumps(payload)
     try:
-        with urllib.request.urlopen(req, timeout=timeout_s) as resp:
-            body = resp.read().decode("utf-8", errors="replace")
-            return int(getattr(resp, "status", 0) or 0), dict(resp.headers), body
-    except urllib.error.HTTPError as e:
-        body = e.read().decode("utf-8", errors="replace") if hasattr(e, "read") else ""
-        return int(getattr(e, "code", 0) or 0), dict(getattr(e, "headers", {}) or {}), body
+        resp = _request(conn, method, url, data, h)
+        raw = resp.read()
+        if (resp.getheader("Content-Encoding") or "").lower() == "gzip":
+            raw = gzip.decompress(raw)
+    except Exception:
+        conn.close()
+        raise
+    if resp.will_close:
+        conn.close()
+    return int(resp.status), dict(resp.getheaders()), raw
 
 
-def _list_models(base_url: str, timeout_s: float) -> List[str]:
-    st, _, body = _http_json("GET", f"{base_url}/v1/models", None, timeout_s=timeout_s)
+def _http_json(
+    conn: HTTPConnection,
+    method: str,
+    url: str,
+    payload: Union[Dict[str, Any], bytes, None],
+    headers: Optional[Dict[str, str]] = None,
+) -> Tuple[int, Dict[str, str], str]:
+    st, resp_headers, raw = _http_json_bytes(conn, method, url, payload, headers)
+    return st, resp_headers, raw.decode("utf-8", errors="replace")
+
+
+def _list_models(conn: HTTPConnection, base_url: str) -> List[str]:
+    st, _, body = _http_json(conn, "GET", f"{base_url}/v1/models", None)
     if st < 200 or st >= 300:
         raise RuntimeError(f"/v1/models failed: http {st}: {body[:500]}")
-    j = json.loads(body)
+    j = _jloads(body)
     out: List[str] = []
     if isinstance(j, dict) and isinstance(j.get("data"), list):
         for it in j["data"]:
@@ -110,59 +177,99 @@ def _pick_model_interactive(models: List[str]) -> str:
         print("模型不存在")
 
 
+def _gzip_reader(read: Callable[[int], bytes]) -> Callable[[int], bytes]:
+    gz = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def read_plain(n: int) -> bytes:
+        while True:
+            chunk = read(n)
+            if not chunk:
+                return gz.flush()
+            out = gz.decompress(chunk)
+            if out:
+                return out
+
+    return read_plain
+
+
+_SSE_DATA = b"data:"
+_SSE_DONE = b"[DONE]"
+
+
 def _sse_chat(
+    conn: HTTPConnection,
     base_url: str,
-    payload: Dict[str, Any],
-    timeout_s: float,
+    payload: Union[Dict[str, Any], bytes],
     headers: Dict[str, str],
 ) -> Tuple[str, Optional[str], bool, Optional[str]]:
-    u = urlparse(f"{base_url}/v1/chat/completions")
-    if u.scheme != "http":
-        raise RuntimeError(f"only http is supported, got {u.scheme}")
-    conn = HTTPConnection(u.hostname, u.port, timeout=timeout_s)
-    body = json.dumps(payload, ensure_ascii=False).encode("utf-8", errors="replace")
-    h = {"Content-Type": "application/json", "Accept": "text/event-stream"}
+    body = payload if isinstance(payload, bytes) else _jdumps(payload)
+    h = {"Content-Type": "application/json", "Accept": "text/event-stream", "Connection": "keep-alive"}
     h.update(headers)
-    conn.request("POST", u.path, body=body, headers=h)
-    resp = conn.getresponse()
+    try:
+        resp = _request(conn, "POST", f"{base_url}/v1/chat/completions", body, h)
+    except Exception:
+        conn.close()
+        raise
     next_session_id = resp.getheader("x-session-id") or resp.getheader("X-Session-Id")
     if resp.status < 200 or resp.status >= 300:
-        raw = resp.read().decode("utf-8", errors="replace")
-        conn.close()
+        try:
+            raw = resp.read().decode("utf-8", errors="replace")
+        except Exception:
+            conn.close()
+            raise
+        if resp.will_close:
+            conn.close()
+        raise RuntimeError(f"chat stream failed: http {resp.status}: {raw[:500]}")
 
-    acc = ""
+    parts: List[str] = []
     finish_reason: Optional[str] = None
     done = False
-    tool_calls: Dict[str, Dict[str, str]] = {}
-    tool_call_printed: Dict[str, bool] = {}
+    tool_calls: Dict[str, Dict[str, Any]] = {}
+    tool_call_printed: Set[str] = set()
+    read_chunk = getattr(resp, "read1", None) or resp.read
+    if (resp.getheader("Content-Encoding") or "").lower() == "gzip":
+        read_chunk = _gzip_reader(read_chunk)
+    buf = bytearray()
+    sys.stdout.flush()
+    out = sys.stdout.buffer
+    enc = sys.stdout.encoding or "utf-8"
+    pending: List[bytes] = []
+    pos = 0
     try:
-        while True:
-            line = resp.readline()
-            if not line:
+        while not done:
+            chunk = read_chunk(65536)
+            if not chunk:
                 break
-            s = line.decode("utf-8", errors="replace").strip()
-            if not s:
-                continue
-            if not s.startswith("data:"):
-                continue
-            data = s[len("data:") :].strip()
-            if data == "[DONE]":
-                done = True
-                break
-            j = json.loads(data)
-            if not isinstance(j, dict):
-                continue
-            choices = j.get("choices")
-            if not isinstance(choices, list) or not choices:
-                continue
-            c0 = choices[0]
-            if not isinstance(c0, dict):
-                continue
-            fr = c0.get("finish_reason")
-            if isinstance(fr, str):
-                finish_reason = fr
-            delta = c0.get("delta")
-            if isinstance(delta, dict):
+            if pos > 32768:
+                del buf[:pos]
+                pos = 0
+            buf += chunk
+            while True:
+                nl = buf.find(b"\n", pos)
+                if nl < 0:
+                    break
+                start = pos
+                pos = nl + 1
+                if nl - start < 6 or not buf.startswith(_SSE_DATA, start, nl):
+                    continue
+                start += 5
+                while start < nl and buf[start] in (0x20, 0x09):
+                    start += 1
+                if buf.startswith(_SSE_DONE, start, nl):
+                    done = True
+                    break
+                data = bytes(buf[start:nl])
+                j = _jloads(data)
+                try:
+                    c0 = j["choices"][0]
+                    fr = c0.get("finish_reason")
+                    delta = c0.get("delta")
+                except (KeyError, IndexError, TypeError, AttributeError):
+                    continue
+                if isinstance(fr, str):
+                    finish_reason = fr
+                if not isinstance(delta, dict):
+                    continue
                 tc = delta.get("tool_calls")
                 if isinstance(tc, list) and tc:
                     for it in tc:
@@ -176,19 +283,20 @@ def _sse_chat(
                             fn = {}
                         name = fn.get("name")
                         args_piece = fn.get("arguments")
-                        st = tool_calls.get(tc_id) or {"name": "", "arguments": ""}
+                        st = tool_calls.get(tc_id)
+                        if st is None:
+                            st = {"name": "", "arguments": []}
+                            tool_calls[tc_id] = st
                         if isinstance(name, str) and name:
                             st["name"] = name
                         if isinstance(args_piece, str) and args_piece:
-                            st["arguments"] = (st.get("arguments") or "") + args_piece
-                        tool_calls[tc_id] = st
+                            st["arguments"].append(args_piece)
 
-                        if not tool_call_printed.get(tc_id):
+                        if tc_id not in tool_call_printed:
                             n = st.get("name") or ""
                             if n:
-                                sys.stdout.write(f"\n[tool_call] id={tc_id} name={n}\n")
-                                sys.stdout.flush()
-                                tool_call_printed[tc_id] = True
+                                pending.append(f"\n[tool_call] id={tc_id} name={n}\n".encode(enc, errors="replace"))
+                                tool_call_printed.add(tc_id)
 
                 tr = delta.get("tool_result")
                 if isinstance(tr, dict):
@@ -200,7 +308,7 @@ def _sse_chat(
                         st = tool_calls.get(tc_id) or {}
                         if not isinstance(name, str) or not name:
                             name = st.get("name") if isinstance(st.get("name"), str) else ""
-                        args = st.get("arguments") if isinstance(st.get("arguments"), str) else ""
+                        args = "".join(st["arguments"]) if st.get("arguments") else ""
                         if ok is True:
                             ok_s = "1"
                         elif ok is False:
@@ -208,25 +316,37 @@ def _sse_chat(
                         else:
                             ok_s = "?"
                         err_s = error if isinstance(error, str) and error else "-"
+                        frame = f"[tool_result] id={tc_id} name={name} ok={ok_s} error={err_s}\n"
                         if args:
-                            sys.stdout.write(f"[tool_args] id={tc_id} {args}\n")
-                        sys.stdout.write(f"[tool_result] id={tc_id} name={name} ok={ok_s} error={err_s}\n")
-                        sys.stdout.flush()
+                            frame = f"[tool_args] id={tc_id} {args}\n" + frame
+                        pending.append(frame.encode(enc, errors="replace"))
 
                 txt = delta.get("content")
                 if isinstance(txt, str) and txt:
-                    acc += txt
-                    sys.stdout.write(txt)
-                    sys.stdout.flush()
+                    parts.append(txt)
+                    pending.append(txt.encode(enc, errors="replace"))
+            if pending:
+                out.write(b"".join(pending))
+                out.flush()
+                pending.clear()
+        if done:
+            resp.read()
+    except BaseException:
+        conn.close()
+        raise
     finally:
-        try:
-            conn.close()
-        except Exception:
-            pass
-    return acc, finish_reason, done, next_session_id
+        if pending:
+            out.write(b"".join(pending))
+            out.flush()
+    if not done or resp.will_close:
+        conn.close()
+    return "".join(parts), finish_reason, done, next_session_id
 
 
-@dataclass
+_DATACLASS_SLOTS: Dict[str, Any] = {"slots": True} if sys.version_info >= (3, 10) else {}
+
+
+@dataclass(**_DATACLASS_SLOTS)
 class ChatState:
     base_url: str
     model: str
@@ -242,33 +362,93 @@ class ChatState:
     max_tool_calls: int
     trace: bool
     messages: List[Dict[str, str]]
+    conn: Optional[HTTPConnection] = field(default=None, repr=False)
+    incremental_when_server_history: bool = True
+    server_history_len: int = 0
+    static_json: Optional[bytes] = field(default=None, repr=False)
+    static_json_key: Optional[Tuple[Any, ...]] = field(default=None, repr=False)
+    msg_json: List[bytes] = field(default_factory=list, repr=False)
+    system_cached: Optional[Tuple[str, Dict[str, str]]] = field(default=None, repr=False)
 
     def headers(self) -> Dict[str, str]:
         return {"x-session-id": self.session_id}
 
+    def system_message(self) -> Dict[str, str]:
+        cached = self.system_cached
+        if cached is None or cached[0] != self.system_prompt:
+            cached = (self.system_prompt, {"role": "system", "content": _clean_text_for_json(self.system_prompt)})
+            self.system_cached = cached
+        return cached[1]
+
     def reset_history(self) -> None:
         self.messages = []
+        self.msg_json = []
+        self.server_history_len = 0
         if self.system_prompt:
-            self.messages.append({"role": "system", "content": _clean_text_for_json(self.system_prompt)})
+            self.messages.append(self.system_message())
 
     def ensure_system(self) -> None:
         if not self.system_prompt:
             return
+        sys_msg = self.system_message()
         if self.messages and self.messages[0].get("role") == "system":
-            self.messages[0] = {"role": "system", "content": _clean_text_for_json(self.system_prompt)}
+            if self.messages[0] is not sys_msg and self.messages[0] != sys_msg:
+                self.messages[0] = sys_msg
+                self.msg_json = []
+                self.server_history_len = 0
             return
-        self.messages.insert(0, {"role": "system", "content": _clean_text_for_json(self.system_prompt)})
+        self.messages.insert(0, sys_msg)
+        self.msg_json = []
+        self.server_history_len = 0
+
+    def adopt_session(self, session_id: Optional[str]) -> bool:
+        if not session_id or session_id == self.session_id:
+            return False
+        self.session_id = session_id
+        self.server_history_len = 0
+        return True
 
+    def outgoing_start(self) -> int:
+        n = self.server_history_len
+        if self.use_server_history and self.incremental_when_server_history and 0 < n < len(self.messages):
+            return n
+        return 0
 
-def _send_one(state: ChatState, role: str, content: str) -> str:
-    state.ensure_system()
-    state.messages.append({"role": role, "content": _clean_text_for_json(content)})
+    def outgoing_messages(self) -> List[Dict[str, str]]:
+        return self.messages[self.outgoing_start():]
+
+    def outgoing_json(self) -> bytes:
+        cache = self.msg_json
+        if len(cache) > len(self.messages):
+            cache.clear()
+        for m in self.messages[len(cache):]:
+            cache.append(_jdumps(m))
+        return b"[" + b",".join(cache[self.outgoing_start():]) + b"]"
+
+
+def _get_conn(state: ChatState) -> HTTPConnection:
+    if state.conn is None:
+        state.conn = _connect(state.base_url, state.timeout_s)
+    return state.conn
+
+
+def _static_payload_json(state: ChatState) -> bytes:
+    key = (
+        state.model,
+        state.session_id,
+        bool(state.use_server_history),
+        state.tool_choice,
+        state.tools_preset,
+        int(state.max_steps),
+        int(state.max_tool_calls),
+        bool(state.trace),
+    )
+    if state.static_json is not None and state.static_json_key == key:
+        return state.static_json
     payload: Dict[str, Any] = {
         "model": state.model,
         "session_id": state.session_id,
         "use_server_history": bool(state.use_server_history),
-        "messages": state.messages,
-        "max_tokens": int(state.max_tokens),
     }
     tools = _build_tools(state.tools_preset)
     if tools:
@@ -282,39 +462,58 @@ def _send_one(state: ChatState, role: str, content: str) -> str:
         payload["tool_choice"] = "none"
     if state.trace:
         payload["trace"] = True
+    state.static_json = _jdumps(payload)[:-1]
+    state.static_json_key = key
+    return state.static_json
+
+
+def _chat_body(state: ChatState) -> bytes:
+    tail = b',"stream":true}' if state.stream else b"}"
+    return (
+        _static_payload_json(state)
+        + b',"max_tokens":'
+        + str(int(state.max_tokens)).encode("ascii")
+        + b',"messages":'
+        + state.outgoing_json()
+        + tail
+    )
+
+
+def _send_one(state: ChatState, role: str, content: str) -> str:
+    state.ensure_system()
+    state.messages.append({"role": role, "content": _clean_text_for_json(content)})
+    sent_from = state.outgoing_start()
+    body = _chat_body(state)
 
     if state.stream:
-        payload["stream"] = True
-        text, fr, done, next_session_id = _sse_chat(state.base_url, payload, timeout_s=state.timeout_s, headers=state.headers())
-        if next_session_id and next_session_id != state.session_id:
-            state.session_id = next_session_id
+        text, fr, done, next_session_id = _sse_chat(_get_conn(state), state.base_url, body, headers=state.headers())
+        new_session = state.adopt_session(next_session_id)
         sys.stdout.write("\n")
         sys.stdout.flush()
         if fr is None and done:
             fr = "stop"
         state.messages.append({"role": "assistant", "content": _clean_text_for_json(text)})
+        if done and not (new_session and sent_from):
+            state.server_history_len = len(state.messages)
         return text
 
-    st, resp_headers, body = _http_json(
-        "POST", f"{state.base_url}/v1/chat/completions", payload, timeout_s=state.timeout_s, headers=state.headers()
+    st, resp_headers, raw = _http_json_bytes(
+        _get_conn(state), "POST", f"{state.base_url}/v1/chat/completions", body, headers=state.headers()
     )
-    next_session_id = resp_headers.get("x-session-id") or resp_headers.get("X-Session-Id")
-    if next_session_id and next_session_id != state.session_id:
-        state.session_id = next_session_id
+    new_session = state.adopt_session(resp_headers.get("x-session-id") or resp_headers.get("X-Session-Id"))
     runtime_trace = resp_headers.get("x-runtime-trace") or resp_headers.get("X-Runtime-Trace")
     if st < 200 or st >= 300:
-        raise RuntimeError(f"chat failed: http {st}: {body[:500]}")
-    j = json.loads(body)
-    txt = ""
-    if isinstance(j, dict):
-        choices = j.get("choices")
-        if isinstance(choices, list) and choices and isinstance(choices[0], dict):
-            msg = choices[0].get("message")
-            if isinstance(msg, dict) and isinstance(msg.get("content"), str):
-                txt = msg["content"]
+        raise RuntimeError(f"chat failed: http {st}: {raw[:2000].decode('utf-8', errors='replace')[:500]}")
+    j = _jloads(raw)
+    try:
+        txt = j["choices"][0]["message"]["content"]
+    except (KeyError, IndexError, TypeError):
+        txt = ""
+    if not isinstance(txt, str):
+        txt = ""
     if state.trace and runtime_trace:
         try:
-            trace_obj = json.loads(runtime_trace)
+            trace_obj = _jloads(runtime_trace)
             sys.stdout.write("\n")
             sys.stdout.write(json.dumps(trace_obj, ensure_ascii=False, indent=2))
             sys.stdout.write("\n")
@@ -325,40 +524,43 @@ def _send_one(state: ChatState, role: str, content: str) -> str:
             sys.stdout.write("\n")
             sys.stdout.flush()
     state.messages.append({"role": "assistant", "content": _clean_text_for_json(txt)})
+    if not (new_session and sent_from):
+        state.server_history_len = len(state.messages)
     return txt
 
 
+_HELP_TEXT = "\n".join(
+    [
+        "命令：",
+        "  /help                      显示帮助",
+        "  /models                    列出可用模型",
+        "  /model <id|序号>           切换模型（不会清空历史）",
+        "  /system <text>             设置 system prompt（会写入历史首条）",
+        "  /stream on|off             打开/关闭流式输出",
+        "  /max_tokens <n>            设置 max_tokens",
+        "  /use_server_history on|off 设置 use_server_history",
+        "  /session <id>              切换 session_id（不会清空本地历史）",
+        "  /tools none|lsp|all|csv     设置 tools（csv 示例：ide.search,ide.read_file）",
+        "  /tool_choice auto|none      设置 tool_choice",
+        "  /max_steps <n>              设置 max_steps（工具循环步数）",
+        "  /max_tool_calls <n>         设置 max_tool_calls（工具调用上限）",
+        "  /trace on|off               输出 x-runtime-trace（非 stream）",
+        "  /lsp_diag <path>            触发 ide.diagnostics",
+        "  /lsp_hover <path> <l> <c>   触发 ide.hover",
+        "  /lsp_def <path> <l> <c>     触发 ide.definition",
+        "  /read <path>                触发 ide.read_file",
+        "  /search <query> [path]      触发 ide.search",
+        "  /clear                     清空本地对话历史（保留 system）",
+        "  /msg <role> <text>         以指定 role 发送一条消息（role: user/system/assistant）",
+        "  /exit                      退出",
+        "",
+        "直接输入文本：作为 user 消息发送；生成过程中按 Ctrl-C 取消本次请求。",
+    ]
+)
+
+
 def _print_help() -> None:
-    print(
-        "\n".join(
-            [
-                "命令：",
-                "  /help                      显示帮助",
-                "  /models                    列出可用模型",
-                "  /model <id|序号>           切换模型（不会清空历史）",
-                "  /system <text>             设置 system prompt（会写入历史首条）",
-                "  /stream on|off             打开/关闭流式输出",
-                "  /max_tokens <n>            设置 max_tokens",
-                "  /use_server_history on|off 设置 use_server_history",
-                "  /session <id>              切换 session_id（不会清空本地历史）",
-                "  /tools none|lsp|all|csv     设置 tools（csv 示例：ide.search,ide.read_file）",
-                "  /tool_choice auto|none      设置 tool_choice",
-                "  /max_steps <n>              设置 max_steps（工具循环步数）",
-                "  /max_tool_calls <n>         设置 max_tool_calls（工具调用上限）",
-                "  /trace on|off               输出 x-runtime-trace（非 stream）",
-                "  /lsp_diag <path>            触发 ide.diagnostics",
-                "  /lsp_hover <path> <l> <c>   触发 ide.hover",
-                "  /lsp_def <path> <l> <c>     触发 ide.definition",
-                "  /read <path>                触发 ide.read_file",
-                "  /search <query> [path]      触发 ide.search",
-                "  /clear                     清空本地对话历史（保留 system）",
-                "  /msg <role> <text>         以指定 role 发送一条消息（role: user/system/assistant）",
-                "  /exit                      退出",
-                "",
-                "直接输入文本：作为 user 消息发送。",
-            ]
-        )
-    )
+    print(_HELP_TEXT)
 
 
 def _parse_on_off(s: str) -> Optional[bool]:
@@ -377,6 +579,273 @@ def _safe_int(s: str) -> int:
         return 0
 
 
+def _send_and_print(state: ChatState, role: str, content: str) -> None:
+    print("")
+    n = len(state.messages)
+    try:
+        state.ensure_system()
+        n = len(state.messages)
+        out = _send_one(state, role, content)
+    except KeyboardInterrupt:
+        if state.conn is not None:
+            state.conn.close()
+        del state.messages[n:]
+        del state.msg_json[n:]
+        print("\n(已取消)")
+        return
+    except Exception as e:
+        print(f"\n请求失败：{e}")
+        return
+    if not state.stream:
+        print(out)
+    print("")
+
+
+def _tool_prompt(tool: str, args: Dict[str, Any], tail: str) -> str:
+    return f"请调用 {tool}，arguments={_jdumps(args).decode('utf-8')}，{tail}"
+
+
+def _cmd_exit(state: ChatState, arg1: str, arg2: str) -> bool:
+    return True
+
+
+def _cmd_help(state: ChatState, arg1: str, arg2: str) -> None:
+    _print_help()
+
+
+def _cmd_models(state: ChatState, arg1: str, arg2: str) -> None:
+    models = _list_models(_get_conn(state), state.base_url)
+    for i, m in enumerate(models, start=1):
+        mark = "*" if m == state.model else " "
+        print(f"{mark} {i:>3}. {m}")
+
+
+def _cmd_model(state: ChatState, arg1: str, arg2: str) -> None:
+    models = _list_models(_get_conn(state), state.base_url)
+    if not arg1:
+        state.model = _pick_model_interactive(models)
+        print(f"已切换模型：{state.model}")
+        return
+    if arg1.isdigit():
+        idx = int(arg1)
+        if 1 <= idx <= len(models):
+            state.model = models[idx - 1]
+            print(f"已切换模型：{state.model}")
+            return
+        print("序号不合法")
+        return
+    if arg1 in models:
+        state.model = arg1
+        print(f"已切换模型：{state.model}")
+        return
+    print("模型不存在")
+
+
+def _cmd_system(state: ChatState, arg1: str, arg2: str) -> None:
+    state.system_prompt = (arg1 + (" " + arg2 if arg2 else "")).strip()
+    state.ensure_system()
+    print("已更新 system prompt")
+
+
+def _cmd_stream(state: ChatState, arg1: str, arg2: str) -> None:
+    b = _parse_on_off(arg1)
+    if b is None:
+        print("用法：/stream on|off")
+        return
+    state.stream = b
+    print(f"stream={1 if state.stream else 0}")
+
+
+def _cmd_use_server_history(state: ChatState, arg1: str, arg2: str) -> None:
+    b = _parse_on_off(arg1)
+    if b is None:
+        print("用法：/use_server_history on|off")
+        return
+    state.use_server_history = b
+    state.server_history_len = 0
+    print(f"use_server_history={1 if state.use_server_history else 0}")
+
+
+def _cmd_max_tokens(state: ChatState, arg1: str, arg2: str) -> None:
+    try:
+        n = int(arg1)
+    except Exception:
+        n = 0
+    if n <= 0:
+        print("用法：/max_tokens <正整数>")
+        return
+    state.max_tokens = n
+    print(f"max_tokens={state.max_tokens}")
+
+
+def _cmd_session(state: ChatState, arg1: str, arg2: str) -> None:
+    if not arg1:
+        print("用法：/session <id>")
+        return
+    state.session_id = arg1.strip()
+    state.server_history_len = 0
+    print(f"session_id={state.session_id}")
+
+
+def _cmd_tools(state: ChatState, arg1: str, arg2: str) -> None:
+    state.tools_preset = (arg1 + (" " + arg2 if arg2 else "")).strip() or "lsp"
+    tools = _build_tools(state.tools_preset)
+    print(f"tools={len(tools)} preset={state.tools_preset}")
+
+
+def _cmd_tool_choice(state: ChatState, arg1: str, arg2: str) -> None:
+    v = arg1.strip().lower()
+    if v not in ("auto", "none"):
+        print("用法：/tool_choice auto|none")
+        return
+    state.tool_choice = v
+    print(f"tool_choice={state.tool_choice}")
+
+
+def _cmd_max_steps(state: ChatState, arg1: str, arg2: str) -> None:
+    n = _safe_int(arg1)
+    if n <= 0:
+        print("用法：/max_steps <正整数>")
+        return
+    state.max_steps = n
+    print(f"max_steps={state.max_steps}")
+
+
+def _cmd_max_tool_calls(state: ChatState, arg1: str, arg2: str) -> None:
+    n = _safe_int(arg1)
+    if n <= 0:
+        print("用法：/max_tool_calls <正整数>")
+        return
+    state.max_tool_calls = n
+    print(f"max_tool_calls={state.max_tool_calls}")
+
+
+def _cmd_trace(state: ChatState, arg1: str, arg2: str) -> None:
+    b = _parse_on_off(arg1)
+    if b is None:
+        print("用法：/trace on|off")
+        return
+    state.trace = b
+    print(f"trace={1 if state.trace else 0}")
+
+
+def _cmd_lsp_diag(state: ChatState, arg1: str, arg2: str) -> None:
+    path = (arg1 + (" " + arg2 if arg2 else "")).strip()
+    if not path:
+        print("用法：/lsp_diag <path>")
+        return
+    _send_and_print(state, "user", _tool_prompt("ide.diagnostics", {"uri": path}, "并给出可读的结果摘要。"))
+
+
+def _cmd_lsp_hover(state: ChatState, arg1: str, arg2: str) -> None:
+    if not arg2:
+        print("用法：/lsp_hover <path> <line> <character>")
+        return
+    parts2 = arg2.strip().split()
+    if len(parts2) != 2:
+        print("用法：/lsp_hover <path> <line> <character>")
+        return
+    path = arg1.strip()
+    line = _safe_int(parts2[0])
+    ch = _safe_int(parts2[1])
+    args = {"uri": path, "line": line, "character": ch}
+    _send_and_print(state, "user", _tool_prompt("ide.hover", args, "并返回 hover 内容。"))
+
+
+def _cmd_lsp_def(state: ChatState, arg1: str, arg2: str) -> None:
+    if not arg2:
+        print("用法：/lsp_def <path> <line> <character>")
+        return
+    parts2 = arg2.strip().split()
+    if len(parts2) != 2:
+        print("用法：/lsp_def <path> <line> <character>")
+        return
+    path = arg1.strip()
+    line = _safe_int(parts2[0])
+    ch = _safe_int(parts2[1])
+    args = {"uri": path, "line": line, "character": ch}
+    _send_and_print(state, "user", _tool_prompt("ide.definition", args, "并返回定义位置。"))
+
+
+def _cmd_read(state: ChatState, arg1: str, arg2: str) -> None:
+    path = (arg1 + (" " + arg2 if arg2 else "")).strip()
+    if not path:
+        print("用法：/read <path>")
+        return
+    _send_and_print(state, "user", _tool_prompt("ide.read_file", {"path": path}, "并返回内容摘要。"))
+
+
+def _cmd_search(state: ChatState, arg1: str, arg2: str) -> None:
+    q = arg1.strip()
+    p = arg2.strip()
+    if not q:
+        print("用法：/search <query> [path]")
+        return
+    args: Dict[str, Any] = {"query": q, "path": p, "max_results": 20} if p else {"query": q, "max_results": 20}
+    _send_and_print(state, "user", _tool_prompt("ide.search", args, "并总结结果。"))
+
+
+def _cmd_clear(state: ChatState, arg1: str, arg2: str) -> None:
+    state.reset_history()
+    print("已清空对话历史")
+
+
+def _cmd_msg(state: ChatState, arg1: str, arg2: str) -> None:
+    role = arg1.strip()
+    content = arg2.strip()
+    if role not in ("user", "system", "assistant"):
+        print("role 只能是 user/system/assistant")
+        return
+    if not content:
+        print("用法：/msg <role> <text>")
+        return
+    _send_and_print(state, role, content)
+
+
+_HANDLERS: Dict[str, Callable[[ChatState, str, str], Optional[bool]]] = {
+    "/exit": _cmd_exit,
+    "/help": _cmd_help,
+    "/models": _cmd_models,
+    "/model": _cmd_model,
+    "/system": _cmd_system,
+    "/stream": _cmd_stream,
+    "/use_server_history": _cmd_use_server_history,
+    "/max_tokens": _cmd_max_tokens,
+    "/session": _cmd_session,
+    "/tools": _cmd_tools,
+    "/tool_choice": _cmd_tool_choice,
+    "/max_steps": _cmd_max_steps,
+    "/max_tool_calls": _cmd_max_tool_calls,
+    "/trace": _cmd_trace,
+    "/lsp_diag": _cmd_lsp_diag,
+    "/lsp_hover": _cmd_lsp_hover,
+    "/lsp_def": _cmd_lsp_def,
+    "/read": _cmd_read,
+    "/search": _cmd_search,
+    "/clear": _cmd_clear,
+    "/msg": _cmd_msg,
+}
+_HANDLERS["/quit"] = _HANDLERS["/exit"]
+
+
+def _split_command(line: str) -> Tuple[str, str, str]:
+    cmd, _, rest = line.strip().partition(" ")
+    arg1, _, arg2 = rest.partition(" ")
+    return cmd.lower(), arg1, arg2
+
+
+def _handle_line(state: ChatState, line: str) -> bool:
+    if line.startswith("/"):
+        cmd, arg1, arg2 = _split_command(line)
+        handler = _HANDLERS.get(cmd)
+        if handler is None:
+            print("未知命令，输入 /help 查看帮助")
+            return False
+        return bool(handler(state, arg1, arg2))
+    _send_and_print(state, "user", line)
+    return False
+
+
 def _interactive(state: ChatState) -> None:
     _print_help()
     while True:
@@ -387,256 +856,23 @@ def _interactive(state: ChatState) -> None:
             return
         if not line.strip():
             continue
+        if _handle_line(state, line):
+            return
 
-        if line.startswith("/"):
-            parts = line.strip().split(" ", 2)
-            cmd = parts[0].lower()
-            arg1 = parts[1] if len(parts) > 1 else ""
-            arg2 = parts[2] if len(parts) > 2 else ""
 
-            if cmd in ("/exit", "/quit"):
-                return
-            if cmd == "/help":
-                _print_help()
-                continue
-            if cmd == "/models":
-                models = _list_models(state.base_url, timeout_s=state.timeout_s)
-                for i, m in enumerate(models, start=1):
-                    mark = "*" if m == state.model else " "
-                    print(f"{mark} {i:>3}. {m}")
-                continue
-            if cmd == "/model":
-                models = _list_models(state.base_url, timeout_s=state.timeout_s)
-                if not arg1:
-                    state.model = _pick_model_interactive(models)
-                    print(f"已切换模型：{state.model}")
-                    continue
-                if arg1.isdigit():
-                    idx = int(arg1)
-                    if 1 <= idx <= len(models):
-                        state.model = models[idx - 1]
-                        print(f"已切换模型：{state.model}")
-                        continue
-                    print("序号不合法")
-                    continue
-                if arg1 in models:
-                    state.model = arg1
-                    print(f"已切换模型：{state.model}")
-                    continue
-                print("模型不存在")
-                continue
-            if cmd == "/system":
-                state.system_prompt = (arg1 + (" " + arg2 if arg2 else "")).strip()
-                state.ensure_system()
-                print("已更新 system prompt")
-                continue
-            if cmd == "/stream":
-                b = _parse_on_off(arg1)
-                if b is None:
-                    print("用法：/stream on|off")
-                    continue
-                state.stream = b
-                print(f"stream={1 if state.stream else 0}")
-                continue
-            if cmd == "/use_server_history":
-                b = _parse_on_off(arg1)
-                if b is None:
-                    print("用法：/use_server_history on|off")
-                    continue
-                state.use_server_history = b
-                print(f"use_server_history={1 if state.use_server_history else 0}")
-                continue
-            if cmd == "/max_tokens":
-                try:
-                    n = int(arg1)
-                except Exception:
-                    n = 0
-                if n <= 0:
-                    print("用法：/max_tokens <正整数>")
-                    continue
-                state.max_tokens = n
-                print(f"max_tokens={state.max_tokens}")
-                continue
-            if cmd == "/session":
-                if not arg1:
-                    print("用法：/session <id>")
-                    continue
-                state.session_id = arg1.strip()
-                print(f"session_id={state.session_id}")
-                continue
-            if cmd == "/tools":
-                state.tools_preset = (arg1 + (" " + arg2 if arg2 else "")).strip() or "lsp"
-                tools = _build_tools(state.tools_preset)
-                print(f"tools={len(tools)} preset={state.tools_preset}")
-                continue
-            if cmd == "/tool_choice":
-                v = arg1.strip().lower()
-                if v not in ("auto", "none"):
-                    print("用法：/tool_choice auto|none")
-                    continue
-                state.tool_choice = v
-                print(f"tool_choice={state.tool_choice}")
-                continue
-            if cmd == "/max_steps":
-                n = _safe_int(arg1)
-                if n <= 0:
-                    print("用法：/max_steps <正整数>")
-                    continue
-                state.max_steps = n
-                print(f"max_steps={state.max_steps}")
-                continue
-            if cmd == "/max_tool_calls":
-                n = _safe_int(arg1)
-                if n <= 0:
-                    print("用法：/max_tool_calls <正整数>")
-                    continue
-                state.max_tool_calls = n
-                print(f"max_tool_calls={state.max_tool_calls}")
-                continue
-            if cmd == "/trace":
-                b = _parse_on_off(arg1)
-                if b is None:
-                    print("用法：/trace on|off")
-                    continue
-                state.trace = b
-                print(f"trace={1 if state.trace else 0}")
-                continue
-            if cmd == "/lsp_diag":
-                path = (arg1 + (" " + arg2 if arg2 else "")).strip()
-                if not path:
-                    print("用法：/lsp_diag <path>")
-                    continue
-                prompt = f"请调用 ide.diagnostics，arguments={{\"uri\":{json.dumps(path, ensure_ascii=False)}}}，并给出可读的结果摘要。"
-                print("")
-                try:
-                    out = _send_one(state, "user", prompt)
-                except Exception as e:
-                    print(f"\n请求失败：{e}")
-                    continue
-                if not state.stream:
-                    print(out)
-                print("")
-                continue
-            if cmd == "/lsp_hover":
-                if not arg2:
-                    print("用法：/lsp_hover <path> <line> <character>")
-                    continue
-                parts2 = arg2.strip().split()
-                if len(parts2) != 2:
-                    print("用法：/lsp_hover <path> <line> <character>")
-                    continue
-                path = arg1.strip()
-                line = _safe_int(parts2[0])
-                ch = _safe_int(parts2[1])
-                prompt = (
-                    f"请调用 ide.hover，arguments={{\"uri\":{json.dumps(path, ensure_ascii=False)},\"line\":{line},\"character\":{ch}}}，并返回 hover 内容。"
-                )
-                print("")
-                try:
-                    out = _send_one(state, "user", prompt)
-                except Exception as e:
-                    print(f"\n请求失败：{e}")
-                    continue
-                if not state.stream:
-                    print(out)
-                print("")
-                continue
-            if cmd == "/lsp_def":
-                if not arg2:
-                    print("用法：/lsp_def <path> <line> <character>")
-                    continue
-                parts2 = arg2.strip().split()
-                if len(parts2) != 2:
-                    print("用法：/lsp_def <path> <line> <character>")
-                    continue
-                path = arg1.strip()
-                line = _safe_int(parts2[0])
-                ch = _safe_int(parts2[1])
-                prompt = (
-                    f"请调用 ide.definition，arguments={{\"uri\":{json.dumps(path, ensure_ascii=False)},\"line\":{line},\"character\":{ch}}}，并返回定义位置。"
-                )
-                print("")
-                try:
-                    out = _send_one(state, "user", prompt)
-                except Exception as e:
-                    print(f"\n请求失败：{e}")
-                    continue
-                if not state.stream:
-                    print(out)
-                print("")
-                continue
-            if cmd == "/read":
-                path = (arg1 + (" " + arg2 if arg2 else "")).strip()
-                if not path:
-                    print("用法：/read <path>")
-                    continue
-                prompt = f"请调用 ide.read_file，arguments={{\"path\":{json.dumps(path, ensure_ascii=False)}}}，并返回内容摘要。"
-                print("")
-                try:
-                    out = _send_one(state, "user", prompt)
-                except Exception as e:
-                    print(f"\n请求失败：{e}")
-                    continue
-                if not state.stream:
-                    print(out)
-                print("")
-                continue
-            if cmd == "/search":
-                q = arg1.strip()
-                p = arg2.strip()
-                if not q:
-                    print("用法：/search <query> [path]")
-                    continue
-                if p:
-                    prompt = f"请调用 ide.search，arguments={{\"query\":{json.dumps(q, ensure_ascii=False)},\"path\":{json.dumps(p, ensure_ascii=False)},\"max_results\":20}}，并总结结果。"
-                else:
-                    prompt = f"请调用 ide.search，arguments={{\"query\":{json.dumps(q, ensure_ascii=False)},\"max_results\":20}}，并总结结果。"
-                print("")
-                try:
-                    out = _send_one(state, "user", prompt)
-                except Exception as e:
-                    print(f"\n请求失败：{e}")
-                    continue
-                if not state.stream:
-                    print(out)
-                print("")
-                continue
-            if cmd == "/clear":
-                state.reset_history()
-                print("已清空对话历史")
-                continue
-            if cmd == "/msg":
-                role = arg1.strip()
-                content = arg2.strip()
-                if role not in ("user", "system", "assistant"):
-                    print("role 只能是 user/system/assistant")
-                    continue
-                if not content:
-                    print("用法：/msg <role> <text>")
-                    continue
-                print("")
-                try:
-                    out = _send_one(state, role, content)
-                except Exception as e:
-                    print(f"\n请求失败：{e}")
-                    continue
-                if not state.stream:
-                    print(out)
-                print("")
+def _run_script(state: ChatState, path: str) -> None:
+    f = sys.stdin if path == "-" else open(path, "r", encoding="utf-8")
+    try:
+        for raw in f:
+            line = raw.rstrip("\r\n")
+            if not line.strip() or line.lstrip().startswith("#"):
                 continue
-
-            print("未知命令，输入 /help 查看帮助")
-            continue
-
-        print("")
-        try:
-            out = _send_one(state, "user", line)
-        except Exception as e:
-            print(f"\n请求失败：{e}")
-            continue
-        if not state.stream:
-            print(out)
-        print("")
+            print(f"> {line}")
+            if _handle_line(state, line):
+                return
+    finally:
+        if f is not sys.stdin:
+            f.close()
 
 
 def main() -> int:
@@ -655,12 +891,14 @@ def main() -> int:
     ap.add_argument("--trace", action="store_true")
     ap.add_argument("--timeout-s", type=float, default=300.0)
     ap.add_argument("--once", default="")
+    ap.add_argument("--script", default="")
     args = ap.parse_args()
 
     _no_proxy_env()
 
     session_id = args.session_id.strip() or f"sess-{uuid.uuid4().hex[:16]}"
-    models = _list_models(args.base_url, timeout_s=float(args.timeout_s))
+    conn = _connect(args.base_url.rstrip("/"), float(args.timeout_s))
+    models = _list_models(conn, args.base_url.rstrip("/"))
     model = args.model.strip()
     if not model:
         model = models[0] if models else ""
@@ -682,6 +920,7 @@ def main() -> int:
         max_tool_calls=int(args.max_tool_calls),
         trace=bool(args.trace),
         messages=[],
+        conn=conn,
     )
     state.reset_history()
 
@@ -706,6 +945,10 @@ def main() -> int:
         print(f"\n(done in {dt:.2f}s, chars={len(out)})")
         return 0
 
+    if args.script:
+        _run_script(state, args.script)
+        return 0
+
     _interactive(state)
     return 0
 
@@ -1,10 +1,64 @@
 import argparse
+import asyncio
 import json
+import os
+import queue
+import signal
+import socket
+import threading
 import time
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from collections import OrderedDict
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
 
 ENGINE = None
 MOCK_BYTES = 0
+PROMPT_CACHE_SIZE = 256
+QUIET = False
+
+
+def _jdumps(obj):
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            pass
+    return json.dumps(obj).encode("utf-8")
+
+
+def _jloads(raw):
+    if orjson is not None:
+        try:
+            return orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(raw.decode("utf-8", errors="replace"))
+
+
+_MOCK_FILL = ("0123456789abcdef" * 1024) + "\n"
+_MODELS_HEAD = _jdumps(
+    {
+        "object": "list",
+        "data": [{"id": "mock-model", "object": "model", "created": 0, "owned_by": "mock-openai"}],
+    }
+)[:-1] + b',"received_auth":'
+_EMBED_HEAD = _jdumps(
+    {
+        "object": "list",
+        "data": [{"object": "embedding", "embedding": [0.1, 0.2, 0.3], "index": 0}],
+    }
+)[:-1] + b',"model":'
+_EMBED_MID = b',"usage":' + _jdumps({"prompt_tokens": None, "total_tokens": None}) + b',"received_auth":'
 
 
 class HfEngine:
@@ -15,6 +69,10 @@ class HfEngine:
         device: str,
         trust_remote_code: bool,
         max_new_tokens_default: int,
+        dtype: str = "auto",
+        compile_model: bool = False,
+        max_batch: int = 1,
+        batch_window_ms: float = 5.0,
     ):
         import torch
         from transformers import AutoModelForCausalLM, AutoTokenizer
@@ -29,14 +87,33 @@ class HfEngine:
             trust_remote_code=trust_remote_code,
             use_fast=True,
         )
+        torch_dtype = {
+            "bf16": torch.bfloat16,
+            "fp16": torch.float16,
+            "fp32": torch.float32,
+        }.get(dtype, "auto")
         self.model = AutoModelForCausalLM.from_pretrained(
             model_path,
             trust_remote_code=trust_remote_code,
-            torch_dtype="auto",
+            torch_dtype=torch_dtype,
         )
         self.model.to(device)
         self.model.eval()
+        if compile_model:
+            self.model.forward = torch.compile(self.model.forward, mode="reduce-overhead", fullgraph=False)
         self.torch = torch
+        self.lock = threading.Lock()
+        self.inputs_cache = OrderedDict()
+        self.max_batch = max(1, int(max_batch))
+        self.batch_window_s = max(0.0, float(batch_window_ms)) / 1000.0
+        if self.max_batch > 1:
+            self.tokenizer.padding_side = "left"
+            if self.tokenizer.pad_token is None:
+                self.tokenizer.pad_token = self.tokenizer.eos_token
+            self.queue = queue.Queue()
+            threading.Thread(target=self._batch_loop, daemon=True).start()
+        if compile_model:
+            self.chat([{"role": "user", "content": "hi"}], max_new_tokens=1, temperature=0)
 
     def list_models(self):
         return [
@@ -69,9 +146,26 @@ class HfEngine:
         lines.append("assistant:")
         return "\n".join(lines)
 
-    def chat(self, messages, max_new_tokens=None, temperature=None, top_p=None):
+    def _to_device(self, inputs):
+        if self.device == "cpu":
+            return inputs
+        return {k: v.to(self.device, non_blocking=True) for k, v in inputs.items()}
+
+    def _inputs(self, messages):
+        key = _jdumps(messages)
+        inputs = self.inputs_cache.get(key)
+        if inputs is not None:
+            self.inputs_cache.move_to_end(key)
+            return inputs
         prompt = self._build_prompt(messages)
+        inputs = self.tokenizer(prompt, return_tensors="pt")
+        inputs = self._to_device(inputs)
+        self.inputs_cache[key] = inputs
+        if len(self.inputs_cache) > PROMPT_CACHE_SIZE:
+            self.inputs_cache.popitem(last=False)
+        return inputs
 
+    def chat(self, messages, max_new_tokens=None, temperature=None, top_p=None):
         max_new_tokens = int(max_new_tokens or self.max_new_tokens_default)
         if max_new_tokens <= 0:
             max_new_tokens = self.max_new_tokens_default
@@ -88,235 +182,415 @@ class HfEngine:
             gen_kwargs["temperature"] = temperature
             gen_kwargs["top_p"] = top_p
 
-        with self.torch.inference_mode():
-            inputs = self.tokenizer(prompt, return_tensors="pt")
-            inputs = {k: v.to(self.device) for k, v in inputs.items()}
+        if self.max_batch > 1:
+            item = {"messages": messages, "kwargs": gen_kwargs, "done": threading.Event(), "result": None, "error": None}
+            self.queue.put(item)
+            item["done"].wait()
+            if item["error"] is not None:
+                raise item["error"]
+            return item["result"]
+
+        with self.lock, self.torch.inference_mode():
+            inputs = self._inputs(messages)
             out = self.model.generate(**inputs, **gen_kwargs)
             new_tokens = out[0][inputs["input_ids"].shape[1] :]
             return self.tokenizer.decode(new_tokens, skip_special_tokens=True)
 
+    def _batch_loop(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.batch_window_s
+            while len(batch) < self.max_batch:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=left))
+                except queue.Empty:
+                    break
+            groups = {}
+            for item in batch:
+                groups.setdefault(tuple(sorted(item["kwargs"].items())), []).append(item)
+            for items in groups.values():
+                self._run_batch(items)
 
-class Handler(BaseHTTPRequestHandler):
-    def _auth_snapshot(self):
-        out = {}
-        for k in ["authorization", "api-key", "x-api-key", "api_key"]:
-            v = self.headers.get(k)
-            if v is None:
-                continue
-            s = str(v)
-            out[k] = {"present": True, "len": len(s)}
-        return out
-
-    def _log_auth(self):
-        snap = self._auth_snapshot()
-        if not snap:
-            print(f"[mock-openai] {self.command} {self.path} auth=none")
-            return
-        keys = ",".join(sorted(snap.keys()))
-        print(f"[mock-openai] {self.command} {self.path} auth_keys={keys}")
-
-    def _send(self, status, obj):
-        data = json.dumps(obj).encode("utf-8")
-        self.send_response(status)
-        self.send_header("Content-Type", "application/json")
-        self.send_header("Content-Length", str(len(data)))
-        self.end_headers()
-        self.wfile.write(data)
+    def _run_batch(self, items):
+        try:
+            prompts = [self._build_prompt(it["messages"]) for it in items]
+            with self.lock, self.torch.inference_mode():
+                inputs = self.tokenizer(prompts, return_tensors="pt", padding=True)
+                inputs = self._to_device(inputs)
+                out = self.model.generate(**inputs, **items[0]["kwargs"])
+            width = inputs["input_ids"].shape[1]
+            for it, row in zip(items, out):
+                it["result"] = self.tokenizer.decode(row[width:], skip_special_tokens=True)
+        except Exception as e:
+            for it in items:
+                it["error"] = e
+        finally:
+            for it in items:
+                it["done"].set()
 
-    def do_GET(self):
-        self._log_auth()
-        if self.path == "/v1/models":
+
+_NOT_FOUND = {"error": {"message": "not found", "type": "invalid_request_error"}}
+
+
+_AUTH_KEYS = ("authorization", "api-key", "x-api-key", "api_key")
+_NO_AUTH = {}
+
+
+def _auth_snapshot(headers):
+    out = None
+    for k in _AUTH_KEYS:
+        v = headers.get(k)
+        if v is None:
+            continue
+        if out is None:
+            out = {}
+        out[k] = {"present": True, "len": len(str(v))}
+    return out or _NO_AUTH
+
+
+def _log_auth(command, path, snap):
+    if QUIET:
+        return
+    if snap is _NO_AUTH:
+        print(f"[mock-openai] {command} {path} auth=none")
+        return
+    keys = ",".join(sorted(snap.keys()))
+    print(f"[mock-openai] {command} {path} auth_keys={keys}")
+
+
+def _reply(status, obj):
+    return status, _jdumps(obj)
+
+
+def _get_reply(path, auth):
+    if path == "/v1/models":
+        if ENGINE is not None:
+            return _reply(200, {"object": "list", "data": ENGINE.list_models(), "received_auth": auth})
+        return 200, _MODELS_HEAD + _jdumps(auth) + b"}"
+    return _reply(404, _NOT_FOUND)
+
+
+def _post_reply(path, body, auth):
+    j = None
+    try:
+        j = _jloads(body) if body else {}
+    except Exception:
+        j = {}
+
+    if path == "/v1/chat/completions":
+        now = time.time_ns() // 1_000_000_000
+        model = str(j.get("model") or (ENGINE.model_id if ENGINE is not None else "mock-model"))
+        messages = j.get("messages") or []
+        if not isinstance(messages, list):
+            messages = []
+        try:
             if ENGINE is not None:
-                self._send(
-                    200,
-                    {
-                        "object": "list",
-                        "data": ENGINE.list_models(),
-                        "received_auth": self._auth_snapshot(),
-                    },
+                content = ENGINE.chat(
+                    messages,
+                    max_new_tokens=j.get("max_tokens") or j.get("max_completion_tokens"),
+                    temperature=j.get("temperature"),
+                    top_p=j.get("top_p"),
                 )
-                return
-            self._send(
+                finish_reason = "stop"
+            else:
+                msg = ""
+                if messages:
+                    last = messages[-1]
+                    if isinstance(last, dict):
+                        msg = str(last.get("content") or "")
+                if isinstance(msg, str) and msg.startswith("TOOL_RESULT "):
+                    content = '{"opencode":{"final":"done"}}'
+                    finish_reason = "stop"
+                    return _reply(
+                        200,
+                        {
+                            "id": f"chatcmpl-{now}",
+                            "object": "chat.completion",
+                            "created": now,
+                            "model": model,
+                            "choices": [
+                                {
+                                    "index": 0,
+                                    "message": {"role": "assistant", "content": content},
+                                    "finish_reason": finish_reason,
+                                }
+                            ],
+                            "usage": {"prompt_tokens": None, "completion_tokens": None, "total_tokens": None},
+                            "received_auth": auth,
+                        },
+                    )
+                max_req = j.get("max_tokens") or j.get("max_completion_tokens")
+                max_req_i = None
+                try:
+                    if max_req is not None:
+                        max_req_i = int(max_req)
+                except Exception:
+                    max_req_i = None
+
+                if MOCK_BYTES and MOCK_BYTES > 0:
+                    cap = MOCK_BYTES
+                    finish_reason = "stop"
+                    if max_req_i is not None and max_req_i > 0 and cap > max_req_i:
+                        cap = max_req_i
+                        finish_reason = "length"
+                    head = f"mock-long:n={len(messages)} bytes={cap} last={msg}\n"
+                    need = cap - len(head)
+                    if need > 0:
+                        content = head + (_MOCK_FILL * -(-need // len(_MOCK_FILL)))[:need]
+                    else:
+                        content = head[:cap]
+                else:
+                    content = f"mock:n={len(messages)} last={msg}"
+                    finish_reason = "stop"
+                    if isinstance(msg, str) and "mock-toolcall:tag" in msg:
+                        content = '<tool_call>ide.search</tool_call><arg_value>{"query":"OpenAiRouter","path":"src","max_results":3}</arg_value>'
+                    if isinstance(msg, str) and "mock-toolcall:weirdtag" in msg:
+                        content = '<tool_call>ide.search</arg_value>{"query":"OpenAiRouter","path":"src","max_results":3}</arg_value>'
+                    if isinstance(msg, str) and "mock-toolcall:opencode" in msg:
+                        content = '{"opencode":{"tool_calls":[{"name":"ide.search","arguments":{"query":"OpenAiRouter","path":"src","max_results":3}}]}}'
+                    if isinstance(msg, str) and "mock-toolcall:cat" in msg:
+                        content = "cat docs/How_to_use.md</arg_value><[PLHD]>"
+                    if isinstance(msg, str) and "mock-toolcall:todowrite_cmd" in msg:
+                        content = 'todowrite status=pending steps=["a","b","c"]'
+                    extra = []
+                    if "temperature" in j:
+                        extra.append(f"temp={j.get('temperature')}")
+                    if "top_p" in j:
+                        extra.append(f"top_p={j.get('top_p')}")
+                    if "min_p" in j:
+                        extra.append(f"min_p={j.get('min_p')}")
+                    if extra:
+                        content += " " + " ".join(extra)
+
+            return _reply(
                 200,
                 {
-                    "object": "list",
-                    "data": [
-                        {"id": "mock-model", "object": "model", "created": 0, "owned_by": "mock-openai"}
+                    "id": f"chatcmpl-{now}",
+                    "object": "chat.completion",
+                    "created": now,
+                    "model": model,
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": content},
+                            "finish_reason": finish_reason,
+                        }
                     ],
-                    "received_auth": self._auth_snapshot(),
+                    "usage": {"prompt_tokens": None, "completion_tokens": None, "total_tokens": None},
+                    "received_auth": auth,
                 },
             )
-            return
-        self._send(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+        except Exception as e:
+            return _reply(
+                500,
+                {
+                    "error": {
+                        "message": f"inference failed: {e}",
+                        "type": "server_error",
+                    }
+                },
+            )
+
+    if path == "/v1/embeddings":
+        model = str(j.get("model") or "mock-model")
+        return 200, _EMBED_HEAD + _jdumps(model) + _EMBED_MID + _jdumps(auth) + b"}"
+
+    return _reply(404, _NOT_FOUND)
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def _auth_snapshot(self):
+        return _auth_snapshot(self.headers)
+
+    def log_message(self, format, *args):
+        if not QUIET:
+            super().log_message(format, *args)
+
+    def _send_bytes(self, status, data):
+        self.log_request(status, len(data))
+        reason = self.responses.get(status, ("",))[0]
+        head = (
+            f"{self.protocol_version} {status} {reason}\r\n"
+            f"Server: {self.version_string()}\r\n"
+            f"Date: {self.date_time_string()}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            "\r\n"
+        ).encode("latin-1")
+        self.wfile.write(head + data)
+
+    def do_GET(self):
+        auth = self._auth_snapshot()
+        _log_auth(self.command, self.path, auth)
+        self._send_bytes(*_get_reply(self.path, auth))
 
     def do_POST(self):
-        self._log_auth()
+        auth = self._auth_snapshot()
+        _log_auth(self.command, self.path, auth)
         length = int(self.headers.get("Content-Length") or "0")
-        body = self.rfile.read(length).decode("utf-8", errors="replace")
-        j = None
-        try:
-            j = json.loads(body) if body else {}
-        except Exception:
-            j = {}
-
-        if self.path == "/v1/chat/completions":
-            model = str(j.get("model") or (ENGINE.model_id if ENGINE is not None else "mock-model"))
-            messages = j.get("messages") or []
-            if not isinstance(messages, list):
-                messages = []
+        body = self.rfile.read(length)
+        self._send_bytes(*_post_reply(self.path, body, auth))
+
+
+async def _handle_conn(reader, writer):
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
             try:
-                if ENGINE is not None:
-                    content = ENGINE.chat(
-                        messages,
-                        max_new_tokens=j.get("max_tokens") or j.get("max_completion_tokens"),
-                        temperature=j.get("temperature"),
-                        top_p=j.get("top_p"),
-                    )
-                    finish_reason = "stop"
-                else:
-                    msg = ""
-                    if messages:
-                        last = messages[-1]
-                        if isinstance(last, dict):
-                            msg = str(last.get("content") or "")
-                    if isinstance(msg, str) and msg.startswith("TOOL_RESULT "):
-                        content = '{"opencode":{"final":"done"}}'
-                        finish_reason = "stop"
-                        self._send(
-                            200,
-                            {
-                                "id": f"chatcmpl-{int(time.time())}",
-                                "object": "chat.completion",
-                                "created": int(time.time()),
-                                "model": model,
-                                "choices": [
-                                    {
-                                        "index": 0,
-                                        "message": {"role": "assistant", "content": content},
-                                        "finish_reason": finish_reason,
-                                    }
-                                ],
-                                "usage": {"prompt_tokens": None, "completion_tokens": None, "total_tokens": None},
-                                "received_auth": self._auth_snapshot(),
-                            },
-                        )
-                        return
-                    max_req = j.get("max_tokens") or j.get("max_completion_tokens")
-                    max_req_i = None
-                    try:
-                        if max_req is not None:
-                            max_req_i = int(max_req)
-                    except Exception:
-                        max_req_i = None
-
-                    if MOCK_BYTES and MOCK_BYTES > 0:
-                        cap = MOCK_BYTES
-                        finish_reason = "stop"
-                        if max_req_i is not None and max_req_i > 0 and cap > max_req_i:
-                            cap = max_req_i
-                            finish_reason = "length"
-                        head = f"mock-long:n={len(messages)} bytes={cap} last={msg}\n"
-                        fill = ("0123456789abcdef" * 1024) + "\n"
-                        out = head
-                        while len(out) < cap:
-                            out += fill
-                        content = out[:cap]
-                    else:
-                        content = f"mock:n={len(messages)} last={msg}"
-                        finish_reason = "stop"
-                        if isinstance(msg, str) and "mock-toolcall:tag" in msg:
-                            content = '<tool_call>ide.search</tool_call><arg_value>{"query":"OpenAiRouter","path":"src","max_results":3}</arg_value>'
-                        if isinstance(msg, str) and "mock-toolcall:weirdtag" in msg:
-                            content = '<tool_call>ide.search</arg_value>{"query":"OpenAiRouter","path":"src","max_results":3}</arg_value>'
-                        if isinstance(msg, str) and "mock-toolcall:opencode" in msg:
-                            content = '{"opencode":{"tool_calls":[{"name":"ide.search","arguments":{"query":"OpenAiRouter","path":"src","max_results":3}}]}}'
-                        if isinstance(msg, str) and "mock-toolcall:cat" in msg:
-                            content = "cat docs/How_to_use.md</arg_value><[PLHD]>"
-                        if isinstance(msg, str) and "mock-toolcall:todowrite_cmd" in msg:
-                            content = 'todowrite status=pending steps=["a","b","c"]'
-                        extra = []
-                        if "temperature" in j:
-                            extra.append(f"temp={j.get('temperature')}")
-                        if "top_p" in j:
-                            extra.append(f"top_p={j.get('top_p')}")
-                        if "min_p" in j:
-                            extra.append(f"min_p={j.get('min_p')}")
-                        if extra:
-                            content += " " + " ".join(extra)
-
-                self._send(
-                    200,
-                    {
-                        "id": f"chatcmpl-{int(time.time())}",
-                        "object": "chat.completion",
-                        "created": int(time.time()),
-                        "model": model,
-                        "choices": [
-                            {
-                                "index": 0,
-                                "message": {"role": "assistant", "content": content},
-                                "finish_reason": finish_reason,
-                            }
-                        ],
-                        "usage": {"prompt_tokens": None, "completion_tokens": None, "total_tokens": None},
-                        "received_auth": self._auth_snapshot(),
-                    },
-                )
-            except Exception as e:
-                self._send(
-                    500,
-                    {
-                        "error": {
-                            "message": f"inference failed: {e}",
-                            "type": "server_error",
-                        }
-                    },
-                )
-            return
+                head = await reader.readuntil(b"\r\n\r\n")
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                return
+            lines = head[:-4].split(b"\r\n")
+            parts = lines[0].split(b" ", 2)
+            if len(parts) != 3:
+                return
+            method = parts[0].decode("latin-1")
+            path = parts[1].decode("latin-1")
+            headers = {}
+            for line in lines[1:]:
+                k, _, v = line.partition(b":")
+                headers[k.strip().lower().decode("latin-1")] = v.strip().decode("latin-1")
+            length = int(headers.get("content-length") or "0")
+            body = await reader.readexactly(length) if length > 0 else b""
 
-        if self.path == "/v1/embeddings":
-            model = str(j.get("model") or "mock-model")
-            self._send(
-                200,
-                {
-                    "object": "list",
-                    "data": [{"object": "embedding", "embedding": [0.1, 0.2, 0.3], "index": 0}],
-                    "model": model,
-                    "usage": {"prompt_tokens": None, "total_tokens": None},
-                    "received_auth": self._auth_snapshot(),
-                },
-            )
-            return
+            auth = _auth_snapshot(headers)
+            _log_auth(method, path, auth)
+            if method == "GET":
+                status, data = _get_reply(path, auth)
+            elif method == "POST" and ENGINE is not None:
+                status, data = await loop.run_in_executor(None, _post_reply, path, body, auth)
+            elif method == "POST":
+                status, data = _post_reply(path, body, auth)
+            else:
+                status, data = _reply(501, {"error": {"message": "unsupported method", "type": "invalid_request_error"}})
 
-        self._send(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+            conn_hdr = headers.get("connection", "").lower()
+            keep = conn_hdr == "keep-alive" or (parts[2] == b"HTTP/1.1" and conn_hdr != "close")
+            out = (
+                f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+                "Content-Type: application/json\r\n"
+                f"Content-Length: {len(data)}\r\n"
+                + ("" if keep else "Connection: close\r\n")
+                + "\r\n"
+            ).encode("latin-1")
+            writer.write(out + data)
+            await writer.drain()
+            if not keep:
+                return
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
 
 
-def main():
-    ap = argparse.ArgumentParser()
-    ap.add_argument("--port", type=int, default=19002)
-    ap.add_argument("--mock-bytes", type=int, default=0)
-    ap.add_argument("--hf-model-path")
-    ap.add_argument("--hf-model-id", default="hf-model")
-    ap.add_argument("--device", default="cpu")
-    ap.add_argument("--trust-remote-code", action="store_true")
-    ap.add_argument("--max-new-tokens", type=int, default=128)
-    args = ap.parse_args()
+async def _serve_async(port, reuse_port=False):
+    server = await asyncio.start_server(_handle_conn, "127.0.0.1", port, reuse_port=reuse_port or None)
+    async with server:
+        await server.serve_forever()
+
+
+class _ReusePortHTTPServer(ThreadingHTTPServer):
+    def server_bind(self):
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
 
-    global ENGINE, MOCK_BYTES
+
+def _serve(args, rank, workers):
+    global ENGINE, MOCK_BYTES, QUIET
     MOCK_BYTES = int(args.mock_bytes or 0)
+    QUIET = bool(args.quiet)
+    device = args.device
+    if workers > 1 and device.startswith("cuda"):
+        os.environ["CUDA_VISIBLE_DEVICES"] = str(rank)
+        device = "cuda"
     if args.hf_model_path:
         ENGINE = HfEngine(
             model_path=args.hf_model_path,
             model_id=args.hf_model_id,
-            device=args.device,
+            device=device,
             trust_remote_code=args.trust_remote_code,
             max_new_tokens_default=args.max_new_tokens,
+            dtype=args.dtype,
+            compile_model=args.compile,
+            max_batch=args.max_batch,
+            batch_window_ms=args.batch_window_ms,
         )
 
-    server = HTTPServer(("127.0.0.1", args.port), Handler)
+    if args.use_async:
+        if uvloop is not None:
+            uvloop.install()
+        asyncio.run(_serve_async(args.port, reuse_port=workers > 1))
+        return
+
+    server_cls = _ReusePortHTTPServer if workers > 1 else ThreadingHTTPServer
+    server = server_cls(("127.0.0.1", args.port), Handler)
     server.serve_forever()
 
 
+def _run_workers(args, workers):
+    children = []
+    for rank in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                _serve(args, rank, workers)
+            except KeyboardInterrupt:
+                pass
+            finally:
+                os._exit(0)
+        children.append(pid)
+
+    def _stop(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, _stop)
+    for pid in children:
+        while True:
+            try:
+                os.waitpid(pid, 0)
+                break
+            except KeyboardInterrupt:
+                _stop(None, None)
+            except ChildProcessError:
+                break
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--port", type=int, default=19002)
+    ap.add_argument("--mock-bytes", type=int, default=0)
+    ap.add_argument("--hf-model-path")
+    ap.add_argument("--hf-model-id", default="hf-model")
+    ap.add_argument("--device", default="cpu")
+    ap.add_argument("--trust-remote-code", action="store_true")
+    ap.add_argument("--max-new-tokens", type=int, default=128)
+    ap.add_argument("--dtype", choices=["auto", "bf16", "fp16", "fp32"], default="auto")
+    ap.add_argument("--compile", action="store_true")
+    ap.add_argument("--max-batch", type=int, default=1)
+    ap.add_argument("--batch-window-ms", type=float, default=5.0)
+    ap.add_argument("--async", dest="use_async", action="store_true")
+    ap.add_argument("--quiet", action="store_true")
+    ap.add_argument("--workers", type=int, default=1)
+    args = ap.parse_args()
+
+    workers = max(1, int(args.workers))
+    if workers > 1:
+        if not hasattr(os, "fork") or not hasattr(socket, "SO_REUSEPORT"):
+            raise SystemExit("--workers > 1 requires fork() and SO_REUSEPORT")
+        _run_workers(args, workers)
+        return
+    _serve(args, 0, 1)
+
+
 if __name__ == "__main__":
     main()
-
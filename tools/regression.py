@@ -1,114 +1,422 @@
 import argparse
+import asyncio
+import atexit
 import json
 import os
+import re
+import select
+import shutil
 import signal
-import socketserver
+import socket
 import subprocess
 import sys
 import threading
 import time
-import urllib.request
-import urllib.error
-from http.client import HTTPConnection
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from http.client import HTTPConnection, RemoteDisconnected
 from urllib.parse import urlparse
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-def http_json(url, payload, headers=None):
-    data = json.dumps(payload).encode("utf-8")
-    req = urllib.request.Request(url, data=data, method="POST")
-    req.add_header("Content-Type", "application/json")
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+
+def _jdumps(obj):
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            pass
+    return json.dumps(obj).encode("utf-8", errors="replace")
+
+
+def _jloads(data):
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    if isinstance(data, (bytes, bytearray)):
+        data = data.decode("utf-8", errors="replace")
+    return json.loads(data)
+
+
+def _load_session(path, key):
+    with open(path, "rb") as f:
+        if ijson is not None:
+            for k, v in ijson.kvitems(f, "sessions", use_float=True):
+                if k == key:
+                    return v
+            return None
+        store = _jloads(f.read())
+    sessions = store.get("sessions") if isinstance(store, dict) else None
+    if not isinstance(sessions, dict):
+        return None
+    return sessions.get(key)
+
+
+_IS_WINDOWS = os.name == "nt"
+_IS_POSIX = os.name == "posix"
+
+_EMPTY_JSON = b"{}"
+_JSON_HEADERS = {"Content-Type": "application/json"}
+_NO_HEADERS = {}
+
+_RESP_OK = b"+OK\r\n"
+_RESP_PONG = b"+PONG\r\n"
+_RESP_NIL = b"$-1\r\n"
+_RESP_NOAUTH = b"-NOAUTH Authentication required\r\n"
+_RESP_UNKNOWN = b"-ERR unknown command\r\n"
+
+_POOL = threading.local()
+
+
+def _pooled_conn(host, port, timeout):
+    conns = getattr(_POOL, "conns", None)
+    if conns is None:
+        conns = {}
+        _POOL.conns = conns
+    conn = conns.get((host, port))
+    if conn is None:
+        conn = HTTPConnection(host, port, timeout=timeout)
+        conns[(host, port)] = conn
+    conn.timeout = timeout
+    if conn.sock is not None:
+        conn.sock.settimeout(timeout)
+    return conn
+
+
+def http_request(method, url, data=None, headers=None, timeout=5):
+    u = urlparse(url)
+    path = (u.path or "/") + ("?" + u.query if u.query else "")
+    h = _JSON_HEADERS if data is not None else _NO_HEADERS
     if headers:
-        for k, v in headers.items():
-            req.add_header(k, v)
-    try:
-        with urllib.request.urlopen(req, timeout=5) as resp:
-            body = resp.read().decode("utf-8", errors="replace")
-            return resp.status, dict(resp.headers), body
-    except urllib.error.HTTPError as e:
-        body = e.read().decode("utf-8", errors="replace")
-        return e.code, dict(e.headers), body
+        h = {**h, **headers}
+    while True:
+        conn = _pooled_conn(u.hostname, u.port or 80, timeout)
+        reused = conn.sock is not None
+        try:
+            conn.request(method, path, body=data, headers=h)
+            resp = conn.getresponse()
+            body = resp.read()
+        except (RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            conn.close()
+            if not reused:
+                raise
+            continue
+        except Exception:
+            conn.close()
+            raise
+        if resp.will_close:
+            conn.close()
+        return resp.status, resp.headers, body
+
+
+def http_json(url, payload, headers=None):
+    return http_request("POST", url, _jdumps(payload), headers)
+
+
+def http_json_bytes(url, body, headers=None):
+    return http_request("POST", url, body, headers)
 
 
 def http_post(url):
-    req = urllib.request.Request(url, data=b"{}", method="POST")
-    req.add_header("Content-Type", "application/json")
-    try:
-        with urllib.request.urlopen(req, timeout=5) as resp:
-            body = resp.read().decode("utf-8", errors="replace")
-            return resp.status, dict(resp.headers), body
-    except urllib.error.HTTPError as e:
-        body = e.read().decode("utf-8", errors="replace")
-        return e.code, dict(e.headers), body
+    return http_request("POST", url, _EMPTY_JSON)
 
 
 def http_get(url):
-    req = urllib.request.Request(url, method="GET")
-    try:
-        with urllib.request.urlopen(req, timeout=5) as resp:
-            body = resp.read().decode("utf-8", errors="replace")
-            return resp.status, dict(resp.headers), body
-    except urllib.error.HTTPError as e:
-        body = e.read().decode("utf-8", errors="replace")
-        return e.code, dict(e.headers), body
+    return http_request("GET", url)
+
+
+_SESSION_STORE_ENV = frozenset(
+    (
+        "RUNTIME_SESSION_STORE",
+        "RUNTIME_SESSION_STORE_PATH",
+        "RUNTIME_SESSION_STORE_ENDPOINT",
+        "RUNTIME_SESSION_STORE_PASSWORD",
+        "RUNTIME_SESSION_STORE_DB",
+    )
+)
+
+_PROBES = tuple(
+    (path, _jdumps(payload))
+    for path, payload in [
+        ("/v1/chat/completions", {"model": "mock-model", "messages": [{"role": "user", "content": "hi"}]}),
+        (
+            "/v1/chat/completions",
+            {
+                "model": "mock-model",
+                "messages": [{"role": "user", "content": "hi"}],
+                "temperature": 0.7,
+                "top_p": 0.9,
+                "min_p": 0.01,
+            },
+        ),
+        (
+            "/v1/chat/completions",
+            {
+                "model": "glm-mock",
+                "messages": [{"role": "user", "content": "hi"}],
+                "temperature": 0.1,
+                "top_p": 0.2,
+                "tools": [
+                    {
+                        "type": "function",
+                        "function": {
+                            "name": "ide.read_file",
+                            "parameters": {"type": "object", "properties": {"path": {"type": "string"}}, "required": ["path"]},
+                        },
+                    }
+                ],
+            },
+        ),
+        ("/v1/chat/completions", {"model": "lmdeploy:mock-model", "messages": [{"role": "user", "content": "hi2"}]}),
+        ("/v1/chat/completions", {"model": "mock-model", "messages": [{"role": "user", "content": [{"type": "text", "text": "hi"}]}]}),
+        ("/v1/embeddings", {"model": "mock-model", "input": "x"}),
+        ("/v1/chat/completions", {"model": "llama_cpp:any", "messages": [{"role": "user", "content": "hi"}]}),
+    ]
+)
 
 
-def wait_ready(url, timeout_s=5, method="GET"):
-    end = time.time() + timeout_s
-    while time.time() < end:
+@lru_cache(maxsize=32)
+def _resolve(host, port):
+    family, _, _, _, sockaddr = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)[0]
+    return family, sockaddr
+
+
+def _exit_watch(p):
+    if p is None:
+        return None
+    if hasattr(os, "pidfd_open"):
         try:
-            if method == "POST":
-                req = urllib.request.Request(url, data=b"{}", method="POST")
-                req.add_header("Content-Type", "application/json")
-            else:
-                req = urllib.request.Request(url, method="GET")
-            with urllib.request.urlopen(req, timeout=1) as resp:
-                resp.read()
+            fd = os.pidfd_open(p.pid)
+        except OSError:
+            return None
+        return fd, lambda: os.close(fd)
+    if hasattr(select, "kqueue"):
+        kq = select.kqueue()
+        try:
+            kq.control(
+                [select.kevent(p.pid, select.KQ_FILTER_PROC, select.KQ_EV_ADD | select.KQ_EV_ONESHOT, select.KQ_NOTE_EXIT)],
+                0,
+            )
+        except OSError:
+            kq.close()
+            return None
+        return kq.fileno(), kq.close
+    return None
+
+
+def wait_ready(url, timeout_s=5, method="GET", proc=None, backoff_min=0.005, backoff_max=0.05, backoff_factor=1.7):
+    end = time.monotonic() + timeout_s
+    data = _EMPTY_JSON if method == "POST" else None
+    u = urlparse(url)
+    family, sockaddr = _resolve(u.hostname, u.port or 80)
+    watch = _exit_watch(proc)
+    delay = backoff_min
+    try:
+        while (remaining := end - time.monotonic()) > 0:
+            if proc is not None and proc.poll() is not None:
+                return False
+            try:
+                with socket.socket(family, socket.SOCK_STREAM) as probe:
+                    probe.settimeout(0.05)
+                    probe.connect(sockaddr)
+                http_request(method, url, data, timeout=1)
                 return True
-        except Exception:
-            time.sleep(0.05)
+            except Exception:
+                pass
+            if watch is not None:
+                select.select([watch[0]], [], [], min(delay, remaining))
+            else:
+                time.sleep(min(delay, remaining))
+            delay = min(delay * backoff_factor, backoff_max)
+    finally:
+        if watch is not None:
+            watch[1]()
     return False
 
 
+def poll_ok(method, url, data, predicate, timeout_s=5, proc=None, backoff_min=0.005, backoff_max=0.05, backoff_factor=1.7):
+    end = time.monotonic() + timeout_s
+    watch = _exit_watch(proc)
+    delay = backoff_min
+    last = (0, {}, b"")
+    try:
+        while True:
+            try:
+                last = http_request(method, url, data, timeout=1)
+                if predicate(last[0], last[2]):
+                    return last
+            except Exception:
+                pass
+            remaining = end - time.monotonic()
+            if remaining <= 0 or (proc is not None and proc.poll() is not None):
+                return last
+            if watch is not None:
+                select.select([watch[0]], [], [], min(delay, remaining))
+            else:
+                time.sleep(min(delay, remaining))
+            delay = min(delay * backoff_factor, backoff_max)
+    finally:
+        if watch is not None:
+            watch[1]()
+
+
+def _drain(stream, tail):
+    try:
+        for line in iter(stream.readline, b""):
+            tail.append(line)
+    finally:
+        stream.close()
+
+
+def start_logged_process(argv, env=None, tail_lines=200):
+    p = start_process(argv, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    tail = deque(maxlen=tail_lines)
+    drain = threading.Thread(target=_drain, args=(p.stdout, tail), daemon=True)
+    drain.start()
+    return p, tail, drain
+
+
+def startup_error(what, p, tail, drain):
+    msg = f"{what} did not start"
+    if p.poll() is not None:
+        msg += f" (exited={p.returncode})"
+        drain.join(timeout=1)
+    text = b"".join(tail).decode("utf-8", errors="replace")[-4000:]
+    if text.strip():
+        msg += f"\n\n--- {what} log tail ---\n" + text
+    return RuntimeError(msg)
+
+
+def _answers(url, method="GET"):
+    try:
+        http_request(method, url, _EMPTY_JSON if method == "POST" else None, timeout=0.5)
+        return True
+    except Exception:
+        return False
+
+
+def _runtime_dll_dirs(runtime):
+    rt_dir = os.path.dirname(os.path.abspath(runtime))
+    dirs = [rt_dir] if os.path.isdir(rt_dir) else []
+    try:
+        with os.scandir(os.path.join(os.path.dirname(rt_dir), "bin")) as it:
+            subdirs = {e.name.lower(): e.path for e in it if e.is_dir()}
+    except OSError:
+        return dirs
+    return dirs + [subdirs[n] for n in ("release", "debug") if n in subdirs]
+
+
+@lru_cache(maxsize=1)
+def _devnull_fd():
+    fd = os.open(os.devnull, os.O_RDWR)
+    atexit.register(os.close, fd)
+    return fd
+
+
 def start_process(argv, env=None, stdout=None, stderr=None):
     if stdout is None:
-        stdout = subprocess.DEVNULL
+        stdout = _devnull_fd()
     if stderr is None:
-        stderr = subprocess.DEVNULL
-    p = subprocess.Popen(argv, env=env, stdout=stdout, stderr=stderr)
+        stderr = _devnull_fd()
+    p = subprocess.Popen(argv, env=env, stdout=stdout, stderr=stderr, start_new_session=_IS_POSIX)
     return p
 
 
-def stop_process(p):
-    if p.poll() is not None:
-        return
-    try:
-        p.send_signal(signal.SIGTERM)
-        p.wait(timeout=2)
-        return
-    except Exception:
-        pass
+def _signal_process(p, sig):
+    if _IS_POSIX:
+        try:
+            os.killpg(p.pid, sig)
+            return
+        except OSError:
+            pass
+    p.send_signal(sig)
+
+
+def stop_all(procs, timeout=2):
+    procs = [p for p in procs if p is not None and p.poll() is None]
+    for p in procs:
+        try:
+            _signal_process(p, signal.SIGTERM)
+        except Exception:
+            pass
+    watches = {p: _exit_watch(p) for p in procs}
     try:
-        p.kill()
-    except Exception:
-        pass
+        deadline = time.monotonic() + timeout
+        while True:
+            procs = [p for p in procs if p.poll() is None]
+            remaining = deadline - time.monotonic()
+            if not procs or remaining <= 0:
+                break
+            fds = [watches[p][0] for p in procs if watches[p] is not None]
+            if len(fds) == len(procs):
+                select.select(fds, [], [], remaining)
+            elif fds:
+                select.select(fds, [], [], min(remaining, 0.02))
+            else:
+                time.sleep(min(remaining, 0.02))
+    finally:
+        for w in watches.values():
+            if w is not None:
+                w[1]()
+    for p in procs:
+        try:
+            if _IS_POSIX:
+                _signal_process(p, signal.SIGKILL)
+            else:
+                p.kill()
+            p.wait(timeout=1)
+        except Exception:
+            pass
 
 
-def extract_chat_content(body: str) -> str:
-    j = json.loads(body)
+def stop_process(p, timeout=2):
+    stop_all([p], timeout)
+
+
+def extract_chat_content(body: bytes) -> str:
+    j = _jloads(body)
     return str(j["choices"][0]["message"]["content"])
 
 
+@lru_cache(maxsize=4)
+def _trace_obj(trace: str):
+    return _jloads(trace)
+
+
+@lru_cache(maxsize=8)
+def _trace_names(trace: str, field: str) -> frozenset:
+    items = _trace_obj(trace).get(field) or []
+    return frozenset(x.get("name") for x in items if isinstance(x, dict))
+
+
+def trace_has_tool(trace: str, field: str, name: str) -> bool:
+    if f'"{field}"' not in trace or f'"{name}"' not in trace:
+        return False
+    return name in _trace_names(trace, field)
+
+
+@lru_cache(maxsize=32)
+def _float_token_re(key: str):
+    return re.compile(r"(?:^|[ ,;\n\r\t])" + re.escape(key) + r"=([-+0-9.eE]+)")
+
+
 def extract_float_token(s: str, key: str):
-    needle = key + "="
-    i = s.find(needle)
-    if i < 0:
+    m = _float_token_re(key).search(s)
+    if m is None:
         return None
-    j = i + len(needle)
-    k = j
-    while k < len(s) and s[k] not in (" ", "\n", "\r", "\t", ",", ";"):
-        k += 1
     try:
-        return float(s[j:k])
+        return float(m.group(1))
     except Exception:
         return None
 
@@ -118,6 +426,22 @@ def assert_close(actual, expected, tol=1e-3):
     assert abs(float(actual) - float(expected)) <= tol
 
 
+def _mcp_refreshed(st, body):
+    if st != 200:
+        return False
+    try:
+        j = _jloads(body)
+    except Exception:
+        return False
+    return (
+        isinstance(j, dict)
+        and j.get("ok") is True
+        and j.get("servers") == 1
+        and j.get("registered", 0) >= 5
+        and not j.get("errors")
+    )
+
+
 class MiniMemoryRespServer:
     def __init__(self, host: str, port: int, password: str | None = None):
         self.host = host
@@ -126,144 +450,197 @@ class MiniMemoryRespServer:
         self._db = {}
         self._srv = None
         self._thr = None
+        self._loop = None
 
     def start(self):
         outer = self
-
-        class Handler(socketserver.StreamRequestHandler):
-            def _readline(self) -> bytes:
-                line = self.rfile.readline()
-                if not line:
-                    raise EOFError()
-                return line
-
-            def _read_exact(self, n: int) -> bytes:
-                data = self.rfile.read(n)
-                if data is None or len(data) != n:
-                    raise EOFError()
-                return data
-
-            def _parse_resp_array(self):
-                head = self._readline()
-                if not head.startswith(b"*"):
+        password = self.password.encode("utf-8")
+        transports = set()
+
+        class Protocol(asyncio.Protocol):
+            _MORE = object()
+
+            def connection_made(self, transport):
+                self.transport = transport
+                self._buf = bytearray()
+                self._pos = 0
+                self._out = []
+                if outer.password:
+                    self._dispatch, self._fallback = self._PREAUTH_DISPATCH, Protocol._do_noauth
+                else:
+                    self._dispatch, self._fallback = self._AUTHED_DISPATCH, Protocol._do_unknown
+                self.selected_db = 0
+                transports.add(transport)
+
+            def connection_lost(self, exc):
+                transports.discard(self.transport)
+
+            def _try_parse(self):
+                buf = self._buf
+                pos = self._pos
+                end = buf.find(b"\r\n", pos)
+                if end < 0:
+                    return self._MORE
+                if buf[pos] != 0x2A:
                     return None
                 try:
-                    n = int(head[1:].strip() or b"0")
-                except Exception:
+                    n = int(buf[pos + 1 : end] or b"0")
+                except ValueError:
                     return None
+                pos = end + 2
                 out = []
                 for _ in range(n):
-                    h = self._readline()
-                    if not h.startswith(b"$"):
+                    end = buf.find(b"\r\n", pos)
+                    if end < 0:
+                        return self._MORE
+                    if buf[pos] != 0x24:
+                        return None
+                    try:
+                        ln = int(buf[pos + 1 : end] or b"-1")
+                    except ValueError:
                         return None
-                    ln = int(h[1:].strip() or b"-1")
+                    pos = end + 2
                     if ln < 0:
                         out.append(None)
                         continue
-                    payload = self._read_exact(ln)
-                    crlf = self._read_exact(2)
-                    if crlf != b"\r\n":
+                    if len(buf) < pos + ln + 2:
+                        return self._MORE
+                    if buf[pos + ln : pos + ln + 2] != b"\r\n":
                         return None
-                    out.append(payload.decode("utf-8", errors="replace"))
+                    out.append(bytes(buf[pos : pos + ln]))
+                    pos += ln + 2
+                self._pos = pos
                 return out
 
+            def data_received(self, data):
+                self._buf += data
+                try:
+                    while True:
+                        cmd = self._try_parse()
+                        if cmd is self._MORE:
+                            break
+                        if not cmd:
+                            self._write_error("ERR protocol error")
+                            self.transport.write(b"".join(self._out))
+                            self.transport.close()
+                            return
+                        self._execute(cmd)
+                finally:
+                    if self._pos:
+                        del self._buf[: self._pos]
+                        self._pos = 0
+                if self._out:
+                    self.transport.write(b"".join(self._out))
+                    self._out.clear()
+
+            def _write(self, data: bytes):
+                self._out.append(data)
+
             def _write_simple(self, s: str):
-                self.wfile.write(b"+" + s.encode("utf-8") + b"\r\n")
-                self.wfile.flush()
+                self._write(b"+%b\r\n" % s.encode("utf-8"))
 
             def _write_error(self, s: str):
-                self.wfile.write(b"-" + s.encode("utf-8") + b"\r\n")
-                self.wfile.flush()
+                self._write(b"-%b\r\n" % s.encode("utf-8"))
 
-            def _write_bulk(self, s: str | None):
-                if s is None:
-                    self.wfile.write(b"$-1\r\n")
-                    self.wfile.flush()
+            def _write_bulk(self, b: bytes | None):
+                if b is None:
+                    self._write(_RESP_NIL)
                     return
-                b = s.encode("utf-8")
-                self.wfile.write(b"$" + str(len(b)).encode("ascii") + b"\r\n" + b + b"\r\n")
-                self.wfile.flush()
-
-            def handle(self):
-                authed = False if outer.password else True
-                selected_db = 0
-                while True:
-                    try:
-                        cmd = self._parse_resp_array()
-                    except EOFError:
-                        return
-                    if not cmd:
-                        self._write_error("ERR protocol error")
-                        return
-                    op = str(cmd[0] or "").upper()
-
-                    if op == "AUTH":
-                        pw = str(cmd[1] or "") if len(cmd) > 1 else ""
-                        if outer.password and pw == outer.password:
-                            authed = True
-                            self._write_simple("OK")
-                        else:
-                            self._write_error("ERR invalid password")
-                        continue
+                self._write(b"$%d\r\n%b\r\n" % (len(b), b))
 
-                    if not authed:
-                        self._write_error("NOAUTH Authentication required")
-                        continue
+            def _do_auth(self, cmd):
+                pw = (cmd[1] or b"") if len(cmd) > 1 else b""
+                if outer.password and pw == password:
+                    self._dispatch, self._fallback = self._AUTHED_DISPATCH, Protocol._do_unknown
+                    self._write(_RESP_OK)
+                else:
+                    self._write_error("ERR invalid password")
 
-                    if op == "SELECT":
-                        try:
-                            selected_db = int(cmd[1] or 0)
-                        except Exception:
-                            selected_db = 0
-                        self._write_simple("OK")
-                        continue
+            def _do_select(self, cmd):
+                try:
+                    self.selected_db = int(cmd[1] or 0)
+                except Exception:
+                    self.selected_db = 0
+                self._write(_RESP_OK)
 
-                    if op == "PING":
-                        self._write_simple("PONG")
-                        continue
+            def _do_ping(self, cmd):
+                self._write(_RESP_PONG)
 
-                    if op == "SET":
-                        if len(cmd) < 3:
-                            self._write_error("ERR wrong number of arguments for 'set' command")
-                            continue
-                        key = str(cmd[1])
-                        value = str(cmd[2])
-                        outer._db[(selected_db, key)] = value
-                        self._write_simple("OK")
-                        continue
+            def _do_set(self, cmd):
+                if len(cmd) < 3:
+                    self._write_error("ERR wrong number of arguments for 'set' command")
+                    return
+                outer._db[(self.selected_db, cmd[1] or b"")] = cmd[2] or b""
+                self._write(_RESP_OK)
 
-                    if op == "GET":
-                        if len(cmd) < 2:
-                            self._write_error("ERR wrong number of arguments for 'get' command")
-                            continue
-                        key = str(cmd[1])
-                        self._write_bulk(outer._db.get((selected_db, key)))
-                        continue
+            def _do_get(self, cmd):
+                if len(cmd) < 2:
+                    self._write_error("ERR wrong number of arguments for 'get' command")
+                    return
+                self._write_bulk(outer._db.get((self.selected_db, cmd[1] or b"")))
+
+            def _do_noauth(self, cmd):
+                self._write(_RESP_NOAUTH)
+
+            def _do_unknown(self, cmd):
+                self._write(_RESP_UNKNOWN)
+
+            _AUTHED_DISPATCH = {
+                b"AUTH": _do_auth,
+                b"SELECT": _do_select,
+                b"PING": _do_ping,
+                b"SET": _do_set,
+                b"GET": _do_get,
+            }
+            _AUTHED_DISPATCH.update({k.lower(): v for k, v in _AUTHED_DISPATCH.items()})
+            _PREAUTH_DISPATCH = {b"AUTH": _do_auth, b"auth": _do_auth}
 
-                    self._write_error("ERR unknown command")
+            def _execute(self, cmd):
+                op = cmd[0] or b""
+                fn = self._dispatch.get(op) or self._dispatch.get(op.upper()) or self._fallback
+                fn(self, cmd)
 
-        class Server(socketserver.ThreadingTCPServer):
-            allow_reuse_address = True
+        loop = asyncio.new_event_loop()
+        try:
+            self._srv = loop.run_until_complete(
+                loop.create_server(Protocol, self.host, self.port, reuse_address=True)
+            )
+        except BaseException:
+            loop.close()
+            raise
 
-        self._srv = Server((self.host, self.port), Handler)
-        self._thr = threading.Thread(target=self._srv.serve_forever, daemon=True)
+        def run():
+            asyncio.set_event_loop(loop)
+            try:
+                loop.run_forever()
+            finally:
+                self._srv.close()
+                for t in list(transports):
+                    t.close()
+                loop.run_until_complete(self._srv.wait_closed())
+                loop.close()
+
+        self._loop = loop
+        self._thr = threading.Thread(target=run, daemon=True)
         self._thr.start()
 
     def stop(self):
-        if self._srv is not None:
+        if self._loop is not None:
             try:
-                self._srv.shutdown()
-            except Exception:
-                pass
-            try:
-                self._srv.server_close()
+                self._loop.call_soon_threadsafe(self._loop.stop)
             except Exception:
                 pass
+            if self._thr is not None:
+                self._thr.join(timeout=2)
+            self._loop = None
             self._srv = None
         self._thr = None
 
-    def get(self, db: int, key: str):
-        return self._db.get((int(db), str(key)))
+    def get(self, db: int, key: str | bytes):
+        if isinstance(key, str):
+            key = key.encode("utf-8")
+        raw = self._db.get((int(db), key))
+        return None if raw is None else raw.decode("utf-8", errors="replace")
 
 
 def main():
@@ -273,84 +650,107 @@ def main():
     ap.add_argument("--openai-port", type=int, default=19002)
     ap.add_argument("--runtime-port", type=int, default=18080)
     ap.add_argument("--workspace-root", default=os.getcwd())
+    ap.add_argument("--reuse", action=argparse.BooleanOptionalAction, default=False)
+    ap.add_argument("--strict", action="store_true")
     args = ap.parse_args()
 
-    env = os.environ.copy()
+    env = {k: v for k, v in os.environ.items() if k not in _SESSION_STORE_ENV}
     env["PYTHONUNBUFFERED"] = "1"
     env["NO_PROXY"] = "127.0.0.1,localhost"
     env["no_proxy"] = "127.0.0.1,localhost"
 
-    mcp = start_process([sys.executable, "tools/mock_mcp_server.py", "--port", str(args.mcp_port), "--mode", "lsp"], env=env)
-    openai = start_process([sys.executable, "tools/mock_openai_server.py", "--port", str(args.openai_port)], env=env)
+    mm = None
+    rt2 = None
+    mcp = mcp_tail = mcp_drain = None
+    openai = None
+    if not (args.reuse and _answers(f"http://127.0.0.1:{args.mcp_port}/", "POST")):
+        mcp, mcp_tail, mcp_drain = start_logged_process(
+            [sys.executable, "tools/mock_mcp_server.py", "--port", str(args.mcp_port), "--mode", "lsp"], env=env
+        )
+    if not (args.reuse and _answers(f"http://127.0.0.1:{args.openai_port}/v1/models", "GET")):
+        openai = start_process([sys.executable, "tools/mock_openai_server.py", "--port", str(args.openai_port)], env=env)
     try:
-        if not wait_ready(f"http://127.0.0.1:{args.mcp_port}/", timeout_s=3, method="POST"):
-            raise RuntimeError("mock mcp server did not start")
-        if not wait_ready(f"http://127.0.0.1:{args.openai_port}/v1/models", timeout_s=3, method="GET"):
-            raise RuntimeError("mock openai server did not start")
-
-        renv = env.copy()
-        renv["RUNTIME_LISTEN_HOST"] = "127.0.0.1"
-        renv["RUNTIME_LISTEN_PORT"] = str(args.runtime_port)
-        renv["MCP_HOSTS"] = f"http://127.0.0.1:{args.mcp_port}/"
-        renv["RUNTIME_WORKSPACE_ROOT"] = args.workspace_root
-        renv["RUNTIME_PROVIDER"] = "mnn"
-        renv["MNN_HOST"] = f"http://127.0.0.1:{args.openai_port}"
-        renv["LMDEPLOY_HOST"] = f"http://127.0.0.1:{args.openai_port}"
+        rt_common = {
+            "RUNTIME_LISTEN_HOST": "127.0.0.1",
+            "MCP_HOSTS": f"http://127.0.0.1:{args.mcp_port}/",
+            "RUNTIME_WORKSPACE_ROOT": args.workspace_root,
+            "RUNTIME_PROVIDER": "mnn",
+            "MNN_HOST": f"http://127.0.0.1:{args.openai_port}",
+            "LMDEPLOY_HOST": f"http://127.0.0.1:{args.openai_port}",
+        }
+        if _IS_WINDOWS:
+            dll_dirs = _runtime_dll_dirs(args.runtime)
+            if dll_dirs:
+                rt_common["PATH"] = os.pathsep.join(dll_dirs + [env.get("PATH", "")])
         store_dir = os.path.join(
             args.workspace_root,
             f".runtime_session_store_dir_{args.runtime_port}_{int(time.time() * 1000)}",
         )
         store_file = os.path.join(store_dir, "sessions.json")
-        renv["RUNTIME_SESSION_STORE"] = store_dir
-        renv["RUNTIME_SESSION_STORE_PATH"] = store_dir
-        renv["RUNTIME_SESSION_STORE_TYPE"] = "file"
-        renv.pop("RUNTIME_SESSION_STORE_ENDPOINT", None)
-        renv.pop("RUNTIME_SESSION_STORE_PASSWORD", None)
-        renv.pop("RUNTIME_SESSION_STORE_DB", None)
-        renv["RUNTIME_SESSION_STORE_NAMESPACE"] = "regression"
-        if os.name == "nt":
-            rt_path = os.path.abspath(args.runtime)
-            rt_dir = os.path.dirname(rt_path)
-            base_dir = os.path.dirname(rt_dir)
-            dll_dirs = [
-                rt_dir,
-                os.path.join(base_dir, "bin", "Release"),
-                os.path.join(base_dir, "bin", "Debug"),
-            ]
-            dll_dirs = [p for p in dll_dirs if os.path.isdir(p)]
-            if dll_dirs:
-                renv["PATH"] = os.pathsep.join(dll_dirs + [renv.get("PATH", "")])
-        rt_log_path = os.path.join(args.workspace_root, f".runtime_regression_{args.runtime_port}.log")
-        rt_log = open(rt_log_path, "wb")
-        rt = start_process([args.runtime], env=renv, stdout=rt_log, stderr=rt_log)
+        renv = {
+            **env,
+            **rt_common,
+            "RUNTIME_LISTEN_PORT": str(args.runtime_port),
+            "RUNTIME_SESSION_STORE": store_dir,
+            "RUNTIME_SESSION_STORE_PATH": store_dir,
+            "RUNTIME_SESSION_STORE_TYPE": "file",
+            "RUNTIME_SESSION_STORE_NAMESPACE": "regression",
+        }
+        rt, rt_tail, rt_drain = start_logged_process([args.runtime], env=renv)
         try:
-            if not wait_ready(f"http://127.0.0.1:{args.runtime_port}/v1/models", timeout_s=3, method="GET"):
-                rt_log.flush()
-                msg = "runtime did not start"
-                if rt.poll() is not None:
-                    msg += f" (exited={rt.returncode})"
-                try:
-                    with open(rt_log_path, "rb") as f:
-                        tail = f.read()[-4000:].decode("utf-8", errors="replace")
-                    if tail.strip():
-                        msg += "\n\n--- runtime log tail ---\n" + tail
-                except Exception:
-                    pass
-                raise RuntimeError(msg)
+            mm_port = args.openai_port + 10
+            mm_password = "pw"
+            mm = MiniMemoryRespServer("127.0.0.1", mm_port, password=mm_password)
+            mm.start()
 
-            st, _, body = http_get(f"http://127.0.0.1:{args.runtime_port}/v1/models")
-            assert st == 200
-            jm = json.loads(body)
-            ids = [x.get("id") for x in jm.get("data", []) if isinstance(x, dict)]
-            assert "mock-model" in ids
-            assert "lmdeploy:mock-model" in ids
+            runtime_port2 = args.runtime_port + 1
+            renv2 = {
+                **env,
+                **rt_common,
+                "RUNTIME_LISTEN_PORT": str(runtime_port2),
+                "RUNTIME_SESSION_STORE_TYPE": "minimemory",
+                "RUNTIME_SESSION_STORE_ENDPOINT": f"http://127.0.0.1:{mm_port}",
+                "RUNTIME_SESSION_STORE_PASSWORD": mm_password,
+                "RUNTIME_SESSION_STORE_DB": "7",
+                "RUNTIME_SESSION_STORE_NAMESPACE": "regression_mm",
+            }
+            rt2, rt2_tail, rt2_drain = start_logged_process([args.runtime], env=renv2)
+            with ThreadPoolExecutor(max_workers=3) as ex:
+                openai_ready, rt_ready, rt2_ready = ex.map(
+                    lambda target: wait_ready(target[0], timeout_s=3, method="GET", proc=target[1]),
+                    [
+                        (f"http://127.0.0.1:{args.openai_port}/v1/models", openai),
+                        (f"http://127.0.0.1:{args.runtime_port}/v1/models", rt),
+                        (f"http://127.0.0.1:{runtime_port2}/v1/models", rt2),
+                    ],
+                )
+            if not openai_ready:
+                raise RuntimeError("mock openai server did not start")
+            if not rt_ready:
+                raise startup_error("runtime", rt, rt_tail, rt_drain)
 
-            st, _, body = http_post(f"http://127.0.0.1:{args.runtime_port}/internal/refresh_mcp_tools")
+            st, _, body = http_get(f"http://127.0.0.1:{args.runtime_port}/v1/models")
             assert st == 200
-            j = json.loads(body)
-            assert j.get("ok") is True
-            assert j.get("servers") == 1
-            assert j.get("registered", 0) >= 5
+            assert b'"id":"mock-model"' in body and b'"id":"lmdeploy:mock-model"' in body
+            if args.strict:
+                jm = _jloads(body)
+                ids = {x.get("id") for x in jm.get("data", []) if isinstance(x, dict)}
+                assert {"mock-model", "lmdeploy:mock-model"} <= ids
+
+            st, _, body = poll_ok(
+                "POST",
+                f"http://127.0.0.1:{args.runtime_port}/internal/refresh_mcp_tools",
+                _EMPTY_JSON,
+                _mcp_refreshed,
+                timeout_s=3,
+                proc=mcp,
+            )
+            if mcp is not None and mcp.poll() is not None and not _mcp_refreshed(st, body):
+                raise startup_error(f"mock mcp server on port {args.mcp_port}", mcp, mcp_tail, mcp_drain)
+            assert _mcp_refreshed(st, body), (
+                f"mock mcp server on port {args.mcp_port} did not register its tools"
+                f" (exit code {mcp.returncode if mcp is not None else None}): http {st}: {body[:500]!r}"
+            )
 
             tool_spec_names = [{"type": "function", "function": {"name": "ide.search"}}]
             tool_spec_full = [
@@ -374,7 +774,7 @@ def main():
             def sse_expect_tool_arguments_object(base_url: str, payload: dict, headers: dict):
                 u = urlparse(f"{base_url}/v1/chat/completions")
                 conn = HTTPConnection(u.hostname, u.port, timeout=10)
-                body = json.dumps(payload).encode("utf-8", errors="replace")
+                body = _jdumps(payload)
                 h = {"Content-Type": "application/json", "Accept": "text/event-stream"}
                 if headers:
                     h.update(headers)
@@ -396,7 +796,7 @@ def main():
                         data = s[len("data:") :].strip()
                         if data == "[DONE]":
                             break
-                        j = json.loads(data)
+                        j = _jloads(data)
                         choices = j.get("choices") if isinstance(j, dict) else None
                         if not isinstance(choices, list) or not choices:
                             continue
@@ -432,20 +832,16 @@ def main():
                 if content != "done":
                     raise AssertionError(f"expected done for trigger={trigger!r}, got={content!r}")
                 trace = headers.get("x-runtime-trace", "")
-                jt = json.loads(trace)
-                assert any(x.get("name") == "ide.search" for x in jt.get("tool_calls") or [])
-                assert any(x.get("name") == "ide.search" for x in jt.get("tool_results") or [])
-                sid = headers.get("x-session-id") or headers.get("X-Session-Id")
+                assert trace_has_tool(trace, "tool_calls", "ide.search")
+                assert trace_has_tool(trace, "tool_results", "ide.search")
+                sid = headers.get("x-session-id")
                 assert sid
-                deadline = time.time() + 2.0
-                while time.time() < deadline and not os.path.exists(store_file):
+                deadline = time.monotonic() + 2.0
+                while time.monotonic() < deadline and not os.path.exists(store_file):
                     time.sleep(0.05)
                 assert os.path.exists(store_file)
-                with open(store_file, "rb") as f:
-                    store = json.loads(f.read().decode("utf-8", errors="replace"))
-                key = f"regression:{sid}"
-                assert key in (store.get("sessions") or {})
-                sess = store["sessions"][key]
+                sess = _load_session(store_file, f"regression:{sid}")
+                assert sess is not None
                 assert any(
                     isinstance(m, dict) and isinstance(m.get("content"), str) and "TOOL_RESULT ide.search" in m.get("content")
                     for m in (sess.get("history") or [])
@@ -473,9 +869,8 @@ def main():
             content = extract_chat_content(body)
             assert content == "done"
             trace = headers.get("x-runtime-trace", "")
-            jt = json.loads(trace)
-            assert any(x.get("name") == "todowrite" for x in jt.get("tool_calls") or [])
-            assert any(x.get("name") == "todowrite" for x in jt.get("tool_results") or [])
+            assert trace_has_tool(trace, "tool_calls", "todowrite")
+            assert trace_has_tool(trace, "tool_results", "todowrite")
 
             payload = {
                 "model": "fake-tool",
@@ -491,7 +886,7 @@ def main():
             }
             st, _, body = http_json(f"http://127.0.0.1:{args.runtime_port}/v1/chat/completions", payload)
             assert st == 200
-            assert "TOOL_RESULT ide.read_file" in body
+            assert "TOOL_RESULT ide.read_file" in extract_chat_content(body)
 
             payload = {
                 "model": "fake-tool",
@@ -512,62 +907,49 @@ def main():
             trace = headers.get("x-runtime-trace", "")
             assert '"used_planner":true' in trace
             assert '"plan_rewrites":1' in trace
-            assert "TOOL_RESULT ide.hover" in body
+            assert "TOOL_RESULT ide.hover" in extract_chat_content(body)
 
-            payload = {"model": "mock-model", "messages": [{"role": "user", "content": "hi"}]}
-            st, _, body = http_json(f"http://127.0.0.1:{args.runtime_port}/v1/chat/completions", payload)
+            rt_base = f"http://127.0.0.1:{args.runtime_port}"
+            results = [http_json_bytes(rt_base + path, body) for path, body in _PROBES]
+            plain, sampling, glm, lmdeploy, content_list, embeddings, llama_cpp = results
+
+            st, _, body = plain
             assert st == 200
-            assert "mock:n=1 last=hi" in body
+            assert "mock:n=1 last=hi" in extract_chat_content(body)
 
-            payload = {
-                "model": "mock-model",
-                "messages": [{"role": "user", "content": "hi"}],
-                "temperature": 0.7,
-                "top_p": 0.9,
-                "min_p": 0.01,
-            }
-            st, _, body = http_json(f"http://127.0.0.1:{args.runtime_port}/v1/chat/completions", payload)
+            st, _, body = sampling
             assert st == 200
             content = extract_chat_content(body)
             assert_close(extract_float_token(content, "temp"), 0.7)
             assert_close(extract_float_token(content, "top_p"), 0.9)
             assert_close(extract_float_token(content, "min_p"), 0.01)
 
-            payload = {
-                "model": "glm-mock",
-                "messages": [{"role": "user", "content": "hi"}],
-                "temperature": 0.1,
-                "top_p": 0.2,
-                "tools": [
-                    {
-                        "type": "function",
-                        "function": {
-                            "name": "ide.read_file",
-                            "parameters": {"type": "object", "properties": {"path": {"type": "string"}}, "required": ["path"]},
-                        },
-                    }
-                ],
-            }
-            st, _, body = http_json(f"http://127.0.0.1:{args.runtime_port}/v1/chat/completions", payload)
+            st, _, body = glm
             assert st == 200
             content = extract_chat_content(body)
             assert_close(extract_float_token(content, "temp"), 0.7)
             assert_close(extract_float_token(content, "top_p"), 1.0)
 
-            payload = {"model": "lmdeploy:mock-model", "messages": [{"role": "user", "content": "hi2"}]}
-            st, _, body = http_json(f"http://127.0.0.1:{args.runtime_port}/v1/chat/completions", payload)
+            st, _, body = lmdeploy
             assert st == 200
-            assert "mock:n=1 last=hi2" in body
+            assert "mock:n=1 last=hi2" in extract_chat_content(body)
 
-            payload = {"model": "mock-model", "messages": [{"role": "user", "content": [{"type": "text", "text": "hi"}]}]}
-            st, _, body = http_json(f"http://127.0.0.1:{args.runtime_port}/v1/chat/completions", payload)
+            st, _, body = content_list
+            assert st == 200
+            assert "mock:n=1 last=hi" in extract_chat_content(body)
+
+            st, _, body = embeddings
             assert st == 200
-            assert "mock:n=1 last=hi" in body
+            assert _jloads(body)["data"][0]["embedding"] == [0.1, 0.2, 0.3]
+
+            st, _, body = llama_cpp
+            assert st == 502
+            assert b"llama_cpp:" in body
 
             payload = {"model": "mock-model", "messages": [{"role": "system", "content": "s"}, {"role": "user", "content": "hi"}]}
             st, headers, body = http_json(f"http://127.0.0.1:{args.runtime_port}/v1/chat/completions", payload)
             assert st == 200
-            sid = headers.get("x-session-id") or headers.get("X-Session-Id")
+            sid = headers.get("x-session-id")
             assert sid
 
             payload = {"model": "mock-model", "messages": [{"role": "user", "content": "next"}]}
@@ -577,139 +959,46 @@ def main():
                 headers={"x-session-id": sid},
             )
             assert st == 200
-            assert "mock:n=4 last=next" in body
+            assert "mock:n=4 last=next" in extract_chat_content(body)
             assert os.path.exists(store_file)
-            with open(store_file, "rb") as f:
-                store = json.loads(f.read().decode("utf-8", errors="replace"))
-            key = f"regression:{sid}"
-            assert isinstance(store, dict)
-            assert isinstance(store.get("sessions"), dict)
-            assert key in store["sessions"]
-            sess = store["sessions"][key]
-            assert isinstance(sess, dict)
-            assert sess.get("session_id") == sid
-            assert isinstance(sess.get("turns"), list)
-            assert len(sess["turns"]) >= 2
-
-            payload = {"model": "mock-model", "input": "x"}
-            st, _, body = http_json(f"http://127.0.0.1:{args.runtime_port}/v1/embeddings", payload)
-            assert st == 200
-            assert '"embedding":[0.1,0.2,0.3]' in body.replace(" ", "")
-
-            payload = {"model": "llama_cpp:any", "messages": [{"role": "user", "content": "hi"}]}
-            st, _, body = http_json(f"http://127.0.0.1:{args.runtime_port}/v1/chat/completions", payload)
-            assert st == 502
-            assert "llama_cpp:" in body
+            sess = _load_session(store_file, f"regression:{sid}")
+            assert sess["session_id"] == sid and len(sess["turns"]) >= 2
 
         finally:
             stop_process(rt)
-            try:
-                rt_log.close()
-            except Exception:
-                pass
-            try:
-                if "store_dir" in locals() and os.path.isdir(store_dir):
-                    for name in os.listdir(store_dir):
-                        try:
-                            os.remove(os.path.join(store_dir, name))
-                        except Exception:
-                            pass
-                    try:
-                        os.rmdir(store_dir)
-                    except Exception:
-                        pass
-            except Exception:
-                pass
-            try:
-                if os.path.exists(rt_log_path):
-                    os.remove(rt_log_path)
-            except Exception:
-                pass
-
-        mm = None
-        rt2 = None
-        rt2_log = None
-        try:
-            mm_port = args.openai_port + 10
-            mm_password = "pw"
-            mm = MiniMemoryRespServer("127.0.0.1", mm_port, password=mm_password)
-            mm.start()
-
-            runtime_port2 = args.runtime_port + 1
-            renv2 = env.copy()
-            renv2["RUNTIME_LISTEN_HOST"] = "127.0.0.1"
-            renv2["RUNTIME_LISTEN_PORT"] = str(runtime_port2)
-            renv2["MCP_HOSTS"] = f"http://127.0.0.1:{args.mcp_port}/"
-            renv2["RUNTIME_WORKSPACE_ROOT"] = args.workspace_root
-            renv2["RUNTIME_PROVIDER"] = "mnn"
-            renv2["MNN_HOST"] = f"http://127.0.0.1:{args.openai_port}"
-            renv2["LMDEPLOY_HOST"] = f"http://127.0.0.1:{args.openai_port}"
-            renv2.pop("RUNTIME_SESSION_STORE", None)
-            renv2.pop("RUNTIME_SESSION_STORE_PATH", None)
-            renv2["RUNTIME_SESSION_STORE_TYPE"] = "minimemory"
-            renv2["RUNTIME_SESSION_STORE_ENDPOINT"] = f"http://127.0.0.1:{mm_port}"
-            renv2["RUNTIME_SESSION_STORE_PASSWORD"] = mm_password
-            renv2["RUNTIME_SESSION_STORE_DB"] = "7"
-            renv2["RUNTIME_SESSION_STORE_NAMESPACE"] = "regression_mm"
-            if os.name == "nt":
-                rt_path = os.path.abspath(args.runtime)
-                rt_dir = os.path.dirname(rt_path)
-                base_dir = os.path.dirname(rt_dir)
-                dll_dirs = [
-                    rt_dir,
-                    os.path.join(base_dir, "bin", "Release"),
-                    os.path.join(base_dir, "bin", "Debug"),
-                ]
-                dll_dirs = [p for p in dll_dirs if os.path.isdir(p)]
-                if dll_dirs:
-                    renv2["PATH"] = os.pathsep.join(dll_dirs + [renv2.get("PATH", "")])
-            rt2_log_path = os.path.join(args.workspace_root, f".runtime_regression_{runtime_port2}.log")
-            rt2_log = open(rt2_log_path, "wb")
-            rt2 = start_process([args.runtime], env=renv2, stdout=rt2_log, stderr=rt2_log)
-            if not wait_ready(f"http://127.0.0.1:{runtime_port2}/v1/models", timeout_s=3, method="GET"):
-                raise RuntimeError("runtime (minimemory) did not start")
-
-            payload = {"model": "mock-model", "messages": [{"role": "system", "content": "s"}, {"role": "user", "content": "hi"}]}
-            st, headers, _ = http_json(f"http://127.0.0.1:{runtime_port2}/v1/chat/completions", payload)
-            assert st == 200
-            sid = headers.get("x-session-id") or headers.get("X-Session-Id")
-            assert sid
-
-            payload = {"model": "mock-model", "messages": [{"role": "user", "content": "next"}]}
-            st, _, _ = http_json(
-                f"http://127.0.0.1:{runtime_port2}/v1/chat/completions",
-                payload,
-                headers={"x-session-id": sid},
-            )
-            assert st == 200
+            if "store_dir" in locals():
+                shutil.rmtree(store_dir, ignore_errors=True)
+
+        if not rt2_ready:
+            raise startup_error("runtime (minimemory)", rt2, rt2_tail, rt2_drain)
+
+        payload = {"model": "mock-model", "messages": [{"role": "system", "content": "s"}, {"role": "user", "content": "hi"}]}
+        st, headers, _ = http_json(f"http://127.0.0.1:{runtime_port2}/v1/chat/completions", payload)
+        assert st == 200
+        sid = headers.get("x-session-id")
+        assert sid
+
+        payload = {"model": "mock-model", "messages": [{"role": "user", "content": "next"}]}
+        st, _, _ = http_json(
+            f"http://127.0.0.1:{runtime_port2}/v1/chat/completions",
+            payload,
+            headers={"x-session-id": sid},
+        )
+        assert st == 200
 
-            key = f"session:regression_mm:{sid}"
-            raw = mm.get(7, key)
-            assert isinstance(raw, str) and raw
-            sj = json.loads(raw)
-            assert isinstance(sj, dict)
-            assert isinstance(sj.get("turns"), list)
-            assert len(sj["turns"]) >= 2
-            assert isinstance(sj.get("history"), list)
+        key = f"session:regression_mm:{sid}"
+        raw = mm.get(7, key)
+        assert isinstance(raw, str) and raw
+        sj = _jloads(raw)
+        assert isinstance(sj, dict)
+        assert isinstance(sj.get("turns"), list)
+        assert len(sj["turns"]) >= 2
+        assert isinstance(sj.get("history"), list)
 
-        finally:
-            if rt2 is not None:
-                stop_process(rt2)
-            try:
-                if rt2_log is not None:
-                    rt2_log.close()
-            except Exception:
-                pass
-            try:
-                if "rt2_log_path" in locals() and os.path.exists(rt2_log_path):
-                    os.remove(rt2_log_path)
-            except Exception:
-                pass
-            if mm is not None:
-                mm.stop()
     finally:
-        stop_process(mcp)
-        stop_process(openai)
+        stop_all([rt2, mcp, openai])
+        if mm is not None:
+            mm.stop()
 
     return 0
 